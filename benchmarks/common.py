@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the MoCo project
+#
+# Copyright (c) 2020 ALBA controls team
+# Distributed under the GNU General Public License v3.
+# See LICENSE for more info.
+
+"""Helpers shared by the benchmarks"""
+
+import time
+
+# simulator without latency: measures the software overhead only
+DEFAULT_URL = 'mocosim://?seed=1'
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    index = min(int(round(fraction * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def measure(func, nb_calls, warmup=3):
+    """
+    Call func nb_calls times and return a dict with the calls per second
+    and the mean/p50/p99/max latency in ms
+    """
+    for _ in range(warmup):
+        func()
+    durations = []
+    start = time.perf_counter()
+    for _ in range(nb_calls):
+        t0 = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - t0)
+    total = time.perf_counter() - start
+    return {
+        'calls': nb_calls,
+        'calls_per_s': nb_calls / total,
+        'mean_ms': 1e3 * total / nb_calls,
+        'p50_ms': 1e3 * percentile(durations, 0.50),
+        'p99_ms': 1e3 * percentile(durations, 0.99),
+        'max_ms': 1e3 * max(durations),
+    }
+
+
+def format_result(name, result):
+    return '{:40s} {:10.1f}/s  p50 {:8.3f} ms  p99 {:8.3f} ms'.format(
+        name, result['calls_per_s'], result['p50_ms'], result['p99_ms'])
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the MoCo project
+#
+# Copyright (c) 2020 ALBA controls team
+# Distributed under the GNU General Public License v3.
+# See LICENSE for more info.
+
+"""
+Concurrency stress test of the connection engines.
+
+Several threads share one Moco and send requests whose answer identifies
+the request (the fake serial port answers '?ECHO <n>' with '<n>'), so any
+mismatched reply is detected. It also reports how many transactions reach
+the port when all threads read ?BEAM at the same time.
+
+    $ python benchmarks/concurrency.py [nb_threads] [nb_calls]
+"""
+
+import sys
+import time
+import threading
+
+from moco.core import Moco, QueuedConn, SyncConn
+
+
+class FakeSerial:
+    """Minimal pyserial stand-in answering ?ECHO and ?BEAM requests"""
+
+    def __init__(self, latency=0.0002):
+        self.latency = latency
+        self.nb_transactions = 0
+        self._answers = []
+
+    def write(self, data):
+        for request in data.decode().split('\r')[:-1]:
+            self.nb_transactions += 1
+            if request.startswith('?ECHO'):
+                answer = request.split()[1]
+            elif request == '?BEAM':
+                answer = '1.5e-09 2.5e-07'
+            else:
+                answer = 'OK'
+            # give other threads the chance to interleave
+            time.sleep(self.latency)
+            self._answers.append('{}\r\n'.format(answer).encode())
+
+    def readline(self):
+        time.sleep(self.latency)
+        return self._answers.pop(0) if self._answers else b''
+
+    def close(self):
+        pass
+
+
+def stress(moco, nb_threads, nb_calls):
+    errors = []
+
+    def worker(index):
+        for call in range(nb_calls):
+            token = '{}.{}'.format(index, call)
+            try:
+                ans = moco.read_cmd('ECHO {}'.format(token))
+            except Exception as error:
+                ans = error
+            if ans != token:
+                errors.append((token, ans))
+
+    threads = [threading.Thread(target=worker, args=(i,))
+               for i in range(nb_threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors, time.perf_counter() - start
+
+
+def merged(moco, serial, nb_threads):
+    barrier = threading.Barrier(nb_threads)
+
+    def worker():
+        barrier.wait()
+        moco.beam()
+
+    serial.nb_transactions = 0
+    threads = [threading.Thread(target=worker) for _ in range(nb_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return serial.nb_transactions
+
+
+def new_moco(queued):
+    conn = SyncConn('loop://', timeout=0.01)
+    serial = conn._conn = FakeSerial()
+    if queued:
+        conn = QueuedConn(conn)
+    return Moco(conn), serial
+
+
+def main(nb_threads=10, nb_calls=200):
+    total = nb_threads * nb_calls
+    for name, queued in (('SyncConn', False), ('QueuedConn', True)):
+        moco, serial = new_moco(queued)
+        errors, duration = stress(moco, nb_threads, nb_calls)
+        print('{:10s}: {:5d}/{} mismatched replies in {:.3f} s'.format(
+            name, len(errors), total, duration))
+        if queued:
+            nb = merged(moco, serial, nb_threads)
+            print('{:10s}: {} concurrent ?BEAM -> {} transaction(s)'.format(
+                name, nb_threads, nb))
+            moco.conn.close()
+            assert not errors, errors[:10]
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
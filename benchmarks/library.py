@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the MoCo project
+#
+# Copyright (c) 2020 ALBA controls team
+# Distributed under the GNU General Public License v3.
+# See LICENSE for more info.
+
+"""moco.core.Moco request/command benchmarks"""
+
+from moco.core import Moco
+
+from common import measure
+
+
+def run(url, nb_calls):
+    moco = Moco.for_url(url)
+    writes = ['TAU 1', 'SETPOINT 0.8', 'SPEED 2 50', 'PHASE 0']
+    benchs = {
+        'read_cmd(STATE)': lambda: moco.read_cmd('STATE'),
+        'read_cmd(BEAM)': lambda: moco.read_cmd('BEAM'),
+        'read_cmd(INFO)': lambda: moco.read_cmd('INFO'),
+        'write_cmd(TAU 1)': lambda: moco.write_cmd('TAU 1'),
+        'write_cmd x4': lambda: [moco.write_cmd(cmd) for cmd in writes],
+        'write_cmds x4': lambda: moco.write_cmds(writes),
+        'beam()': moco.beam,
+        'move_speed()': moco.move_speed,
+    }
+    results = {}
+    for name, func in benchs.items():
+        results[name] = measure(func, nb_calls)
+    moco.conn.close()
+    return results
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the MoCo project
+#
+# Copyright (c) 2020 ALBA controls team
+# Distributed under the GNU General Public License v3.
+# See LICENSE for more info.
+
+"""
+End-to-end time of the moco_* Sardana macros (requires sardana).
+
+The macro functions are called directly, outside of a MacroServer, with
+a minimal macro object, against a Tango Moco device connected to the
+simulator.
+"""
+
+import importlib
+
+from common import measure
+
+MACROS = [
+    ('moco_status', ()),
+    ('moco_info', ()),
+    ('moco_piezo', (None,)),
+    ('moco_mode', (None,)),
+    ('moco_phase', (None,)),
+    ('moco_operationflags', ([],)),
+    ('moco_piezo', (1.0,)),
+]
+
+
+class Macro:
+    """The part of the Macro API used by the MoCo macros"""
+
+    def outputBlock(self, msg):
+        pass
+
+    def output(self, msg, *args):
+        pass
+
+    def debug(self, msg, *args):
+        pass
+
+
+def run(url, nb_calls):
+    from tango.test_context import DeviceTestContext
+    from sardana.macroserver.macro import Type
+    from moco.tango.server.moco import Moco
+
+    # parameter types are registered by the MacroServer on startup
+    for name in ('String', 'Float'):
+        Type.addType(name)
+
+    results = {}
+    context = DeviceTestContext(Moco, properties={'url': url},
+                                process=False)
+    with context:
+        macros = importlib.import_module('moco.sardana.macro.moco_utils')
+        # there is no Tango database to find it with the test context
+        macros.moco.select(context.get_device_access())
+        macro = Macro()
+        for name, args in MACROS:
+            func = getattr(macros, name)
+            key = '{}({})'.format(name, ', '.join(map(repr, args)))
+            results[key] = measure(lambda: func(macro, *args), nb_calls)
+    return results
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the MoCo project
+#
+# Copyright (c) 2020 ALBA controls team
+# Distributed under the GNU General Public License v3.
+# See LICENSE for more info.
+
+"""
+Latency of multi-line answers (?INFO, ?HELP).
+
+Compares the former timeout bound pyserial ``readlines()`` with the '$'
+framed reader of SyncConn. The pyserial ``loop://`` transport is used as
+stand-in for the controller: the bytes written are read back as answer.
+The answers with an indented closing marker ('  $') are checked too.
+
+    $ python benchmarks/multiline.py [nb_calls]
+"""
+
+import sys
+import time
+
+from moco.core import SyncConn
+
+INFO = (
+    b'$\r\n'
+    b' MOCO 01.02  -  Current settings:\r\n'
+    b'  NAME "no name"\r\n'
+    b'  OPRANGE 0 10 0\r\n'
+    b'  INBEAM SOFT 1\r\n'
+    b'  OUTBEAM EXT NORM UNIP 1.25e-08 AUTO\r\n'
+    b'  MODE INTENSITY\r\n'
+    b'  SETPOINT 0.8\r\n'
+    b'  TAU 1\r\n'
+    b'  SPEED 2 50\r\n'
+    b'$\r\n'
+)
+
+# some firmwares indent the closing marker
+INFO_INDENTED = INFO[:-3] + b'  $\r\n'
+
+
+def timeit(func, nb_calls):
+    start = time.perf_counter()
+    for _ in range(nb_calls):
+        func()
+    return (time.perf_counter() - start) / nb_calls
+
+
+def main(nb_calls=3):
+    conn = SyncConn('loop://')
+
+    def readlines():
+        conn._conn.write(INFO)
+        return conn._conn.readlines()
+
+    def framed():
+        return conn.write_readlines(INFO)
+
+    assert readlines() == framed()
+    # the framed reader must stop at the indented marker, not time out
+    assert conn.write_readlines(INFO_INDENTED) == \
+        INFO_INDENTED.splitlines(keepends=True)
+    indented = conn.write_readblocks(INFO_INDENTED * 2, 2)
+    assert indented == [INFO_INDENTED.splitlines(keepends=True)] * 2
+    before = timeit(readlines, nb_calls)
+    after = timeit(framed, nb_calls)
+    print('readlines(): {:10.3f} ms/call'.format(before * 1e3))
+    print('framed:      {:10.3f} ms/call'.format(after * 1e3))
+    print('speedup:     {:10.1f} x'.format(before / after))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
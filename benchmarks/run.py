@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the MoCo project
+#
+# Copyright (c) 2020 ALBA controls team
+# Distributed under the GNU General Public License v3.
+# See LICENSE for more info.
+
+"""
+MoCo benchmark suite.
+
+Runs the library, Tango device and Sardana macro benchmarks against the
+simulator and writes the results as JSON, so runs before and after a
+change can be compared:
+
+    $ python benchmarks/run.py -o before.json
+    $ python benchmarks/run.py --url 'mocosim://?byte_time=0.00104' \\
+        -o 9600.json
+"""
+
+import sys
+import json
+import time
+import argparse
+import platform
+
+import library
+import macros
+import tango_device
+from common import DEFAULT_URL, format_result
+
+SUITES = {
+    'library': library.run,
+    'tango': tango_device.run,
+    'macros': macros.run,
+}
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--url', default=DEFAULT_URL,
+                        help='controller URL (default: %(default)s)')
+    parser.add_argument('-n', '--calls', type=int, default=200,
+                        help='calls per benchmark (default: %(default)s)')
+    parser.add_argument('-o', '--output', help='JSON output file')
+    parser.add_argument('suites', nargs='*', metavar='suite',
+                        help='suites to run: {} (default: all)'.format(
+                            ', '.join(SUITES)))
+    args = parser.parse_args(args)
+    for suite in args.suites:
+        if suite not in SUITES:
+            parser.error('unknown suite {!r}'.format(suite))
+
+    report = {
+        'time': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'url': args.url,
+        'results': {},
+    }
+    for suite in args.suites or SUITES:
+        try:
+            results = SUITES[suite](args.url, args.calls)
+        except ImportError as error:
+            print('skipping {} benchmarks: {}'.format(suite, error))
+            continue
+        report['results'][suite] = results
+        for name, result in results.items():
+            print(format_result('{}: {}'.format(suite, name), result))
+
+    if args.output:
+        with open(args.output, 'w') as fobj:
+            json.dump(report, fobj, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+
+if __name__ == '__main__':
+    main()
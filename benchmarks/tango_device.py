@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the MoCo project
+#
+# Copyright (c) 2020 ALBA controls team
+# Distributed under the GNU General Public License v3.
+# See LICENSE for more info.
+
+"""Tango Moco device attribute read benchmarks (requires pytango)"""
+
+import time
+
+from common import measure
+
+ATTRIBUTES = [
+    'InBeamConf', 'OutBeamConf', 'SetPoint', 'Mode', 'Tau', 'SoftBeam',
+    'OperationFlags', 'Beam', 'Beam_In', 'Beam_Out', 'FBeam', 'FBeam_In',
+    'FBeam_Out', 'MocoState', 'Piezo', 'Speed', 'ScanSpeed', 'MoveSpeed',
+    'OscBeamMainSignal', 'OscBeamQuadSignal', 'Phase', 'Amplitude',
+    'Frequency', 'Slope', 'Oscil',
+]
+
+SIGNALS = ['Beam_In', 'Beam_Out', 'FBeam_In', 'FBeam_Out']
+
+POLLING_PERIOD = 100  # ms
+
+
+def run(url, nb_calls):
+    from tango.test_context import DeviceTestContext
+    from moco.tango.server.moco import Moco
+
+    results = {}
+    context = DeviceTestContext(Moco, properties={'url': url},
+                                process=False)
+    with context as proxy:
+        results['read Beam_In'] = measure(
+            lambda: proxy.read_attribute('Beam_In'), nb_calls)
+        results['read_attributes signals x4'] = measure(
+            lambda: proxy.read_attributes(SIGNALS), nb_calls)
+        results['read_attributes all x{}'.format(len(ATTRIBUTES))] = measure(
+            lambda: proxy.read_attributes(ATTRIBUTES), nb_calls)
+        for name in SIGNALS:
+            proxy.poll_attribute(name, POLLING_PERIOD)
+        # let the polling buffer fill in
+        time.sleep(3 * POLLING_PERIOD / 1000)
+        results['polled read_attributes signals x4'] = measure(
+            lambda: proxy.read_attributes(SIGNALS), nb_calls)
+    return results
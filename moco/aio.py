@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the MoCo project
+#
+# Copyright (c) 2020 ALBA controls team
+# Distributed under the GNU General Public License v3.
+# See LICENSE for more info.
+
+"""
+asyncio client for the MoCo. Several controllers can be driven from a single
+event loop::
+
+    mocos = [AsyncMoco.for_url(url) for url in urls]
+    states = await asyncio.gather(*(moco.state() for moco in mocos))
+
+``socket://host:port`` URLs use a plain asyncio TCP connection. Any other
+pyserial URL (device path, ``rfc2217://``, ...) requires the
+``pyserial-asyncio`` package.
+"""
+
+import time
+import asyncio
+import logging
+import urllib.parse
+
+from .commands import CONFIG_CMDS, PARAMS, PARAMS_BY_CMD, SNAPSHOT_CMDS
+from .core import (_check_answers, _config_cmds, _decode_answer,
+                   _failed_block, _failed_requests, _known_speeds,
+                   _KnownSpeeds)
+
+
+class AsyncConn:
+
+    # Multi-line answers start and end with a line holding a single '$'
+    MULTILINE_MARK = b'$'
+
+    def __init__(self, url, timeout=1.5, **kwargs):
+        self.log = logging.getLogger('{}.AsyncConn'.format(__name__))
+        self.url = url
+        self.timeout = timeout
+        self.kwargs = kwargs
+        self._reader = None
+        self._writer = None
+        self._lock = None
+
+    async def open(self):
+        if self.url.startswith('socket://'):
+            url = urllib.parse.urlparse(self.url)
+            coro = asyncio.open_connection(url.hostname, url.port)
+        else:
+            import serial_asyncio
+            coro = serial_asyncio.open_serial_connection(url=self.url,
+                                                         **self.kwargs)
+        self._reader, self._writer = await asyncio.wait_for(coro,
+                                                            self.timeout)
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._reader = self._writer = None
+
+    async def _transaction(self, func, data, *args):
+        # created here to bind the lock to the running loop
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._writer is None:
+                await self.open()
+            try:
+                self._writer.write(data)
+                return await func(*args)
+            except BaseException:
+                # a late answer (or the rest of a cancelled one) would be
+                # read as the answer of the next request: start afresh
+                await self.close()
+                raise
+
+    async def _readline(self):
+        try:
+            line = await asyncio.wait_for(self._reader.readline(),
+                                          self.timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError('No answer after {} s'.format(self.timeout))
+        if not line.endswith(b'\n'):
+            raise ConnectionError(
+                'Connection closed by the controller: {!r}'.format(line))
+        return line
+
+    async def _readlines(self, nb_lines):
+        return [await self._readline() for _ in range(nb_lines)]
+
+    async def _readblock(self):
+        line = await self._readline()
+        lines = [line]
+        if line.strip() != self.MULTILINE_MARK:
+            return lines
+        while True:
+            line = await self._readline()
+            lines.append(line)
+            if line.strip() == self.MULTILINE_MARK:
+                return lines
+
+    async def _readblocks(self, nb_answers):
+        return [await self._readblock() for _ in range(nb_answers)]
+
+    async def _readblocks_checked(self, nb_answers):
+        blocks = await self._readblocks(nb_answers)
+        if any(_failed_block(block) for block in blocks):
+            self._writer.write(b'?ERR\r')
+            blocks.append([await self._readline()])
+        return blocks
+
+    async def _drain(self):
+        await self._writer.drain()
+
+    async def write_raw(self, data):
+        self.log.debug('write_raw -> %r', data)
+        await self._transaction(self._drain, data)
+
+    async def write_readline(self, data):
+        self.log.debug('write_readline write -> %r', data)
+        ans = await self._transaction(self._readline, data)
+        self.log.debug('write_readline read -> %r', ans)
+        return ans
+
+    async def write_readline_many(self, data, nb_lines):
+        self.log.debug('write_readline_many write -> %r', data)
+        ans = await self._transaction(self._readlines, data, nb_lines)
+        self.log.debug('write_readline_many read -> %r', ans)
+        return ans
+
+    async def write_readblocks(self, data, nb_answers):
+        self.log.debug('write_readblocks write -> %r', data)
+        ans = await self._transaction(self._readblocks, data, nb_answers)
+        self.log.debug('write_readblocks read -> %r', ans)
+        return ans
+
+    async def write_readblocks_checked(self, data, nb_answers):
+        """
+        write_readblocks() also asking ?ERR in the same transaction if a
+        request failed: its answer is then appended as an extra block
+        """
+        self.log.debug('write_readblocks_checked write -> %r', data)
+        ans = await self._transaction(self._readblocks_checked, data,
+                                      nb_answers)
+        self.log.debug('write_readblocks_checked read -> %r', ans)
+        return ans
+
+    async def write_readlines(self, data):
+        self.log.debug('write_readlines write -> %r', data)
+        ans = await self._transaction(self._readblock, data)
+        self.log.debug('write_readlines read -> %r', ans)
+        return ans
+
+
+class AsyncMoco(_KnownSpeeds):
+    """asyncio version of moco.core.Moco"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._speeds = None
+
+    @classmethod
+    def for_url(cls, url, **kwargs):
+        conn = AsyncConn(url, **kwargs)
+        return cls(conn)
+
+    async def write_cmd(self, cmd):
+        data = '{}\r?ERR\r'.format(cmd)
+        try:
+            ans = await self.conn.write_readline(data.encode())
+        except Exception:
+            self._speeds = _known_speeds(self._speeds, cmd, ok=False)
+            raise
+        ans = ans.decode()
+        ans = ans.strip('\r\n')
+        if ans.lower() != 'ok':
+            self._speeds = _known_speeds(self._speeds, cmd, ok=False)
+            raise Exception('Error: {}'.format(ans))
+        self._speeds = _known_speeds(self._speeds, cmd)
+
+    async def write_cmds(self, cmds):
+        """
+        Send the commands back to back and read all their ?ERR answers in
+        a single pass. Raises reporting every command that failed.
+        """
+        cmds = list(cmds)
+        if not cmds:
+            return
+        data = ''.join('{}\r?ERR\r'.format(cmd) for cmd in cmds)
+        try:
+            answers = await self.conn.write_readline_many(data.encode(),
+                                                          len(cmds))
+            _check_answers(cmds, answers)
+        except Exception:
+            for cmd in cmds:
+                self._speeds = _known_speeds(self._speeds, cmd, ok=False)
+            raise
+        for cmd in cmds:
+            self._speeds = _known_speeds(self._speeds, cmd)
+
+    async def read_cmd(self, cmd):
+        return await self._read_cmd(cmd, '?{}\r'.format(cmd).encode())
+
+    async def _read_cmd(self, cmd, data):
+        """read_cmd() of the already encoded request data"""
+        # Any request may get a '$' framed answer (e.g. ?HELP, ?INFO).
+        # The ?ERR of a failed request is read in the same transaction
+        blocks = await self.conn.write_readblocks_checked(data, 1)
+        ans = _decode_answer(blocks[0])
+
+        if ans == 'ERROR':
+            err = blocks[-1][0].decode().strip('\r\n')
+            raise Exception('Error: {}'.format(err))
+        return ans
+
+    async def read_cmds(self, cmds):
+        """
+        Send the requests back to back and read all their answers in a
+        single pass. Raises reporting every request that failed.
+        """
+        cmds = list(cmds)
+        if not cmds:
+            return []
+        data = ''.join('?{}\r'.format(cmd) for cmd in cmds)
+        blocks = await self.conn.write_readblocks_checked(data.encode(),
+                                                          len(cmds))
+        answers = [_decode_answer(lines) for lines in blocks[:len(cmds)]]
+        failed = _failed_requests(cmds, answers)
+        if failed:
+            err = blocks[-1][0].decode()
+            err = err.strip('\r\n')
+            raise Exception('Error: {} (last error: {})'.format(failed, err))
+        if 'SPEED' in cmds:
+            scan_speed, move_speed = answers[cmds.index('SPEED')].split()
+            self._speeds = float(scan_speed), float(move_speed)
+        return answers
+
+    async def read_many(self, cmds):
+        cmds = list(cmds)
+        answers = await self.read_cmds(cmds)
+        values = {}
+        for cmd, ans in zip(cmds, answers):
+            param = PARAMS_BY_CMD.get(cmd)
+            values[cmd] = ans if param is None else param.decode(ans)
+        return values
+
+    async def snapshot(self):
+        timestamp = time.time()
+        values = await self.read_many(SNAPSHOT_CMDS)
+        return dict(time=timestamp, values=values)
+
+    async def config(self):
+        return await self.read_many(CONFIG_CMDS)
+
+    async def apply_config(self, config):
+        cmds = _config_cmds(await self.config(), config)
+        await self.write_cmds(cmds)
+        return cmds
+
+    # ------------------------------------------------------------------------
+    #                           Attributes
+    # ------------------------------------------------------------------------
+    # The plain parameters are generated from moco.commands.PARAMS
+
+    async def beam(self):
+        beam = await self.read_cmd('BEAM')
+        beam_in, beam_out = beam.split()
+        beam_in = float(beam_in)
+        beam_out = float(beam_out)
+        return beam, beam_in, beam_out
+
+    async def fbeam(self):
+        fbeam = await self.read_cmd('FBEAM')
+        fbeam_in, fbeam_out = fbeam.split()
+        fbeam_in = float(fbeam_in)
+        fbeam_out = float(fbeam_out)
+        return fbeam, fbeam_in, fbeam_out
+
+    async def speed(self, values=None):
+        if values is None:
+            scan_speed, move_speed = (await self.read_cmd('SPEED')).split()
+            self._speeds = float(scan_speed), float(move_speed)
+            return self._speeds
+        str_values = ''
+        for value in values:
+            str_values += '{} '.format(str(value))
+        cmd = 'SPEED {}'.format(str_values)
+        await self.write_cmd(cmd)
+
+    async def speeds(self):
+        speeds = self._speeds
+        if speeds is None:
+            speeds = await self.speed()
+        return speeds
+
+    async def set_speeds(self, scan=None, move=None):
+        if move is None:
+            if scan is not None:
+                await self.speed([scan])
+            return
+        if scan is None:
+            scan, _ = await self.speeds()
+        await self.speed([scan, move])
+
+    async def scan_speed(self, value=None):
+        if value is None:
+            scan_speed, _ = await self.speeds()
+            return scan_speed
+        await self.set_speeds(scan=value)
+
+    async def move_speed(self, value=None):
+        if value is None:
+            _, move_speed = await self.speeds()
+            return move_speed
+        await self.set_speeds(move=value)
+
+    async def osc_beam_signals(self):
+        main_signal, quad_signal = (await self.read_cmd('OSCBEAM')).split()
+        main_signal = float(main_signal)
+        quad_signal = float(quad_signal)
+        return main_signal, quad_signal
+
+    # ------------------------------------------------------------------------
+    #                           Commands
+    # ------------------------------------------------------------------------
+
+    async def tune(self):
+        await self.write_cmd('TUNE')
+
+    async def tune_peak(self):
+        await self.write_cmd('TUNE PEAK')
+
+    async def go(self):
+        await self.write_cmd('GO')
+
+    async def stop(self):
+        await self.write_cmd('STOP')
+
+    async def pause(self, arg):
+        await self.write_cmd('PAUSE {}'.format(arg))
+
+    async def set_operation_flags(self, args):
+        flags = ' '.join(args)
+        cmd = 'SET {}'.format(flags)
+        await self.write_cmd(cmd)
+
+    async def clear_operation_flags(self, args):
+        flags = ' '.join(args)
+        cmd = 'CLEAR {}'.format(flags)
+        await self.write_cmd(cmd)
+
+    async def reset(self):
+        # The reset command do not allow to check the error after
+        self._speeds = None
+        await self.conn.write_raw(b'RESET\r')
+
+
+def _accessor(param):
+    cmd, query, decode, encode = (param.cmd, param.query, param.decode,
+                                  param.encode)
+    if param.read_only:
+        async def accessor(self):
+            return decode(await self._read_cmd(cmd, query))
+    else:
+        async def accessor(self, value=None):
+            if value is None:
+                return decode(await self._read_cmd(cmd, query))
+            await self.write_cmd(encode(value))
+    accessor.__name__ = accessor.__qualname__ = param.name
+    accessor.__doc__ = '{} (?{})'.format(param.doc, cmd)
+    return accessor
+
+
+for _param in PARAMS:
+    if _param.name is not None:
+        setattr(AsyncMoco, _param.name, _accessor(_param))
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the MoCo project
+#
+# Copyright (c) 2020 ALBA controls team
+# Distributed under the GNU General Public License v3.
+# See LICENSE for more info.
+
+"""
+Declarative table of the MoCo parameters.
+
+The library accessors (moco.core, moco.aio), the Tango attributes and the
+Sardana macros are generated from PARAMS. This module has no dependency
+so that any of them can import it.
+"""
+
+
+class Param:
+    """
+    A controller parameter, read with ?<cmd> and (unless read_only)
+    written with <cmd> <value>.
+
+    dtype is float or str. arity is the number of values of the answer:
+    a str answer of arity 1 is returned whole, arity None splits it into
+    a list of words. A multi_line answer is the list of its lines.
+    name, attr and macro are the names of the generated library
+    accessor, Tango attribute and Sardana macro (None: not generated).
+    attr_read_only (default read_only) is the access of the Tango
+    attribute and macro_arg (default name) the name of the macro
+    parameter.
+    """
+
+    def __init__(self, cmd, dtype, arity=1, read_only=False,
+                 multi_line=False, name=None, attr=None, macro=None, doc='',
+                 attr_read_only=None, macro_arg=None):
+        self.cmd = cmd
+        self.dtype = dtype
+        self.arity = arity
+        self.read_only = read_only
+        self.multi_line = multi_line
+        self.name = name
+        self.attr = attr
+        self.macro = macro
+        self.doc = doc
+        self.attr_read_only = (read_only if attr_read_only is None
+                               else attr_read_only)
+        self.macro_arg = name if macro_arg is None else macro_arg
+        # precompiled request, answer decoder and command encoder
+        self.query = '?{}\r'.format(cmd).encode()
+        self.decode = self._decoder()
+        fmt = '{} {{}}'.format(cmd).format
+        if arity != 1:
+            self.encode = lambda values: fmt(' '.join(map(str, values)))
+        elif dtype is float:
+            self.encode = lambda value: fmt(float(value))
+        else:
+            self.encode = fmt
+
+    def _decoder(self):
+        if self.multi_line:
+            return list
+        if self.arity is None:
+            return str.split
+        if self.dtype is float:
+            if self.arity == 1:
+                return float
+            return lambda ans: tuple(float(value) for value in ans.split())
+        return str
+
+    def __repr__(self):
+        return 'Param({!r})'.format(self.cmd)
+
+
+PARAMS = [
+    Param('INBEAM', str, name='in_beam_conf', attr='InBeamConf',
+          macro='moco_inbeam_conf', macro_arg='config',
+          doc='INBEAM configuration'),
+    Param('OUTBEAM', str, name='out_beam_conf', attr='OutBeamConf',
+          macro='moco_outbeam_conf', macro_arg='config',
+          doc='OUTBEAM configuration'),
+    Param('SETPOINT', float, name='set_point', attr='SetPoint',
+          macro='moco_setpoint', doc='setpoint value'),
+    Param('MODE', str, name='mode', attr='Mode', macro='moco_mode',
+          doc='operation mode'),
+    Param('TAU', float, name='tau', attr='Tau', macro='moco_tau',
+          doc='regulation time constant'),
+    Param('SOFTBEAM', float, name='soft_beam', attr='SoftBeam',
+          macro='moco_softbeam', macro_arg='softbeam',
+          doc='software INBEAM value'),
+    Param('SET', str, arity=None, read_only=True, name='operation_flags',
+          attr='OperationFlags', doc='operation flags'),
+    Param('STATE', str, read_only=True, name='state', attr='MocoState',
+          doc='controller state'),
+    Param('PIEZO', float, name='piezo', attr='Piezo', macro='moco_piezo',
+          macro_arg='pos', doc='output voltage'),
+    Param('PHASE', float, name='phase', attr='Phase', macro='moco_phase',
+          doc='oscillation phase'),
+    Param('AMPLITUDE', float, name='amplitude', attr='Amplitude',
+          macro='moco_amplitude', doc='oscillation amplitude'),
+    Param('FREQUENCY', float, name='frequency', attr='Frequency',
+          macro='moco_frequency', macro_arg='freq',
+          doc='oscillation frequency'),
+    Param('SLOPE', float, name='slope', attr='Slope', macro='moco_slope',
+          doc='response function slope'),
+    # written with the OscilOn/OscilOff commands of the Tango device
+    Param('OSCIL', str, name='oscil', attr='Oscil', attr_read_only=True,
+          doc='oscillation (ON/OFF)'),
+    Param('INFO', str, read_only=True, multi_line=True, name='info',
+          doc='controller information'),
+    # accessors, attributes and macros of these ones are hand-written
+    Param('BEAM', float, arity=2, read_only=True,
+          doc='INBEAM and OUTBEAM signals'),
+    Param('FBEAM', float, arity=2, read_only=True,
+          doc='filtered INBEAM and OUTBEAM signals'),
+    Param('OSCBEAM', float, arity=2, read_only=True,
+          doc='main and quadrature oscillation signals'),
+    Param('SPEED', float, arity=2, doc='scan and move speeds'),
+]
+
+PARAMS_BY_CMD = {param.cmd: param for param in PARAMS}
+
+# requests of a full readout (all but the long ?INFO)
+SNAPSHOT_CMDS = [param.cmd for param in PARAMS if not param.multi_line]
+
+# settings saved and restored by Moco.config()/apply_config(), in the
+# order they are written
+CONFIG_CMDS = ['MODE', 'INBEAM', 'OUTBEAM', 'SOFTBEAM', 'SETPOINT', 'TAU',
+               'SPEED', 'PHASE', 'AMPLITUDE', 'FREQUENCY', 'SLOPE', 'OSCIL',
+               'SET']
+
+# operation flags replacing each other on SET (and never cleared)
+SIDE_FLAGS = ('LEFT', 'RIGHT')
@@ -6,122 +6,1022 @@
 # Distributed under the GNU General Public License v3.
 # See LICENSE for more info.
 
+import json
+import math
+import time
+import bisect
+import queue
 import serial
 import logging
+import threading
+import collections
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from .commands import (CONFIG_CMDS, PARAMS, PARAMS_BY_CMD, SIDE_FLAGS,
+                       SNAPSHOT_CMDS)
+
+# in-process simulator URLs (mocosim://)
+serial.protocol_handler_packages.append('moco.simulator')
+
+
+def _decode_answer(lines):
+    """Decode a request answer: a string or a list of strings if multi-line"""
+    if len(lines) > 1:
+        # Remove $ character used on multilines commands
+        return [line.decode().strip('\r\n') for line in lines[1:-1]]
+    return lines[0].decode().strip('\r\n')
+
+
+def _failed_block(block):
+    """True if a raw answer block (list of lines) is the ERROR answer"""
+    return len(block) == 1 and block[0].strip() == b'ERROR'
+
+
+def _failed_requests(cmds, answers):
+    """Return the description of the failed requests of a read_cmds() burst"""
+    return ', '.join('?{}'.format(cmd) for cmd, ans in zip(cmds, answers)
+                     if ans == 'ERROR')
+
+
+def _check_answers(cmds, answers):
+    """Check the ?ERR answers of a write_cmds() burst"""
+    errors = []
+    for cmd, ans in zip(cmds, answers):
+        ans = ans.decode()
+        ans = ans.strip('\r\n')
+        if ans.lower() != 'ok':
+            errors.append('{!r}: {}'.format(cmd, ans))
+    if errors:
+        raise Exception('Error: {}'.format('; '.join(errors)))
+
+
+def _known_speeds(speeds, cmd, ok=True):
+    """
+    Return the (scan, move) speed pair known after the write command cmd
+    (None if unknown). speeds is the pair known before.
+    """
+    if not ok:
+        # a failed write may have changed anything (e.g. lost link)
+        return None
+    words = cmd.split()
+    name = words[0].upper() if words else ''
+    if name == 'RESET':
+        return None
+    if name != 'SPEED':
+        return speeds
+    try:
+        values = tuple(float(word) for word in words[1:])
+    except ValueError:
+        return None
+    if len(values) == 2:
+        return values
+    # a single value only sets the scan speed
+    if len(values) == 1 and speeds is not None:
+        return values[0], speeds[1]
+    return None
+
+
+# time (s) the speeds known by Moco.speeds() are trusted: other clients
+# may change them
+SPEEDS_TTL = 60.0
+
+
+class _KnownSpeeds:
+    """Base of Moco and moco.aio.AsyncMoco keeping the known speeds"""
+
+    _speeds_value = None
+    _speeds_time = 0.0
+
+    @property
+    def _speeds(self):
+        """
+        (scan, move) speeds last read or written, None if unknown or older
+        than SPEEDS_TTL
+        """
+        if (self._speeds_value is not None and
+                time.monotonic() - self._speeds_time > SPEEDS_TTL):
+            return None
+        return self._speeds_value
+
+    @_speeds.setter
+    def _speeds(self, speeds):
+        self._speeds_value = speeds
+        self._speeds_time = time.monotonic()
+
+
+def _config_cmds(current, config):
+    """
+    Return the commands applying the settings of config which differ
+    from the current ones (both as returned by Moco.config())
+    """
+    unknown = set(config) - set(CONFIG_CMDS)
+    if unknown:
+        raise Exception('Error: unknown settings: {}'.format(
+            ', '.join(sorted(unknown))))
+    cmds = []
+    flags = config.get('SET')
+    if flags is not None:
+        clear = [flag for flag in current['SET']
+                 if flag not in flags and flag not in SIDE_FLAGS]
+        if clear:
+            cmds.append('CLEAR {}'.format(' '.join(clear)))
+    for cmd in CONFIG_CMDS:
+        if cmd == 'SET' or cmd not in config:
+            continue
+        value = config[cmd]
+        if isinstance(value, list):
+            # JSON has no tuples
+            value = tuple(value)
+        if value != current[cmd]:
+            cmds.append(PARAMS_BY_CMD[cmd].encode(value))
+    if flags is not None:
+        flags = [flag for flag in flags if flag not in current['SET']]
+        if flags:
+            cmds.append('SET {}'.format(' '.join(flags)))
+    return cmds
 
 
 class SyncConn:
-    def __init__(self, url, timeout=1.5, **kwargs):
+    """
+    Blocking connection to the controller. If stats (an IOStats) is given
+    every transaction is counted in it. If recorder (a
+    moco.recording.Recorder) is given every transaction is logged to it.
+    """
+
+    # Multi-line answers start and end with a line holding a single '$'
+    MULTILINE_MARK = b'$'
+    # lines skipped by resync() before giving up
+    MAX_STALE_LINES = 100
+
+    def __init__(self, url, timeout=1.5, stats=None, recorder=None,
+                 **kwargs):
         self.log = logging.getLogger('{}.SyncConn'.format(__name__))
+        self.stats = stats
+        self.recorder = recorder
         self._conn = serial.serial_for_url(url, timeout=timeout, **kwargs)
 
+    def close(self):
+        self._conn.close()
+
+    def _record(self, data, ans, start, error=None):
+        if self.stats is not None:
+            self.stats.record(data, ans, time.perf_counter() - start, error)
+        if self.recorder is not None:
+            if error is None:
+                self.recorder.answer(data, ans)
+            else:
+                self.recorder.error(data, error)
+
+    def _transaction(self, name, data, read):
+        # %r: the repr is only built if debug logging is enabled
+        self.log.debug('%s write -> %r', name, data)
+        if self.recorder is not None:
+            self.recorder.request(name, data)
+        start = time.perf_counter()
+        try:
+            self._conn.write(data)
+            ans = read()
+        except Exception as error:
+            self._record(data, None, start, error)
+            raise
+        self._record(data, ans, start)
+        self.log.debug('%s read -> %r', name, ans)
+        return ans
+
     def write_raw(self, data):
-        self.log.debug('write_raw -> %s', repr(data))
-        self._conn.write(data)
+        self._transaction('write_raw', data, lambda: None)
 
     def write_readline(self, data):
-        self.log.debug('write_readline write -> %s', repr(data))
-        self._conn.write(data)
-        ans = self._conn.readline()
-        self.log.debug('write_readline read -> %s', repr(ans))
-        return ans
+        return self._transaction('write_readline', data, self._conn.readline)
+
+    def write_readline_many(self, data, nb_lines):
+        return self._transaction(
+            'write_readline_many', data,
+            lambda: [self._conn.readline() for _ in range(nb_lines)])
 
     def write_readlines(self, data):
-        self.log.debug('write_readlines write -> %s', repr(data))
-        self._conn.write(data)
-        ans = self._conn.readlines()
-        self.log.debug('write_readlines read -> %s', repr(ans))
+        """
+        Write data and read a complete answer. A multi-line answer is read
+        up to its closing '$' line (markers included) instead of waiting
+        for the serial timeout. Single line answers return a one item list.
+        """
+        return self._transaction('write_readlines', data, self._readblock)
+
+    def write_readblocks(self, data, nb_answers):
+        """Write data and read nb_answers (maybe multi-line) answers"""
+        return self._transaction(
+            'write_readblocks', data,
+            lambda: [self._readblock() for _ in range(nb_answers)])
+
+    def write_readblocks_checked(self, data, nb_answers):
+        """
+        write_readblocks() also asking ?ERR in the same transaction if a
+        request failed: its answer is then appended as an extra block
+        """
+        def read():
+            blocks = [self._readblock() for _ in range(nb_answers)]
+            if any(_failed_block(block) for block in blocks):
+                self._conn.write(b'?ERR\r')
+                blocks.append([self._conn.readline()])
+            return blocks
+        return self._transaction('write_readblocks_checked', data, read)
+
+    def resync(self, probe, answer, timeout):
+        """
+        Drop any pending input (e.g. the late end of a timed out answer)
+        and check the controller answers probe with a line starting with
+        answer. Stale lines still arriving are skipped.
+        """
+        self.log.debug('resync -> %r', probe)
+        if self.recorder is not None:
+            self.recorder.request('resync', probe)
+        old_timeout = self._conn.timeout
+        self._conn.timeout = timeout
+        start = time.perf_counter()
+        try:
+            self._conn.reset_input_buffer()
+            self._conn.write(probe)
+            for _ in range(self.MAX_STALE_LINES):
+                line = self._conn.readline()
+                if not line.endswith(b'\n'):
+                    raise TimeoutError('No answer to {!r}'.format(probe))
+                if line.startswith(answer):
+                    self._record(probe, line, start)
+                    return line
+            raise Exception('Error: unexpected answers to {!r}'.format(probe))
+        except Exception as error:
+            self._record(probe, None, start, error)
+            raise
+        finally:
+            self._conn.timeout = old_timeout
+
+    def _readblock(self):
+        line = self._conn.readline()
+        lines = [line]
+        if line.strip() != self.MULTILINE_MARK:
+            return lines
+        while True:
+            line = self._conn.readline()
+            if not line.endswith(b'\n'):
+                raise TimeoutError(
+                    'Incomplete multi-line answer: {!r}'.format(lines))
+            lines.append(line)
+            if line.strip() == self.MULTILINE_MARK:
+                return lines
+
+
+def _complete(ans):
+    """True if no line of a SyncConn answer was cut by the timeout"""
+    if isinstance(ans, bytes):
+        return ans.endswith(b'\n')
+    if isinstance(ans, list):
+        return all(_complete(item) for item in ans)
+    return True
+
+
+def _size(ans):
+    """Number of bytes of a SyncConn answer"""
+    if isinstance(ans, bytes):
+        return len(ans)
+    if isinstance(ans, list):
+        return sum(_size(item) for item in ans)
+    return 0
+
+
+def _command_key(data):
+    """
+    IOStats key of a transaction: the command names of data ('?BEAM',
+    'TAU' for 'TAU 1.0', '?BEAM ?FBEAM' for a burst...) without the ?ERR
+    checks of the writes
+    """
+    names = [cmd.split(None, 1)[0] for cmd in data.split(b'\r')
+             if cmd.strip()]
+    names = [name for name in names if name != b'?ERR'] or names
+    return b' '.join(names).decode(errors='replace')
+
+
+class _Counters:
+
+    __slots__ = ('count', 'errors', 'timeouts', 'bytes_out', 'bytes_in',
+                 'total_latency', 'max_latency', 'histogram')
+
+    def __init__(self, nb_buckets):
+        self.count = self.errors = self.timeouts = 0
+        self.bytes_out = self.bytes_in = 0
+        self.total_latency = self.max_latency = 0.0
+        self.histogram = [0] * nb_buckets
+
+    def merge(self, other):
+        self.count += other.count
+        self.errors += other.errors
+        self.timeouts += other.timeouts
+        self.bytes_out += other.bytes_out
+        self.bytes_in += other.bytes_in
+        self.total_latency += other.total_latency
+        self.max_latency = max(self.max_latency, other.max_latency)
+        self.histogram = [a + b for a, b in zip(self.histogram,
+                                                other.histogram)]
+
+
+class IOStats:
+    """
+    Statistics of the SyncConn transactions by command (see _command_key):
+    number of transactions, errors, timeouts (incomplete answers
+    included), bytes written and read and a latency histogram.
+
+    The histogram has BUCKETS_PER_DECADE log spaced buckets from
+    MIN_LATENCY to MAX_LATENCY seconds: the percentiles are the upper
+    bound of their bucket (within 26%), capped by the maximum latency.
+    """
+
+    MIN_LATENCY = 1e-4
+    MAX_LATENCY = 100.0
+    BUCKETS_PER_DECADE = 10
+    PERCENTILES = (50, 95, 99)
+
+    def __init__(self):
+        decades = round(math.log10(self.MAX_LATENCY / self.MIN_LATENCY))
+        self.bounds = [self.MIN_LATENCY * 10 ** (i / self.BUCKETS_PER_DECADE)
+                       for i in range(decades * self.BUCKETS_PER_DECADE + 1)]
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}
+            self.since = time.time()
+
+    def record(self, data, ans, latency, error=None):
+        if error is None:
+            timeout = not _complete(ans)
+        else:
+            timeout = isinstance(error, (TimeoutError,
+                                         serial.SerialTimeoutException))
+        key = _command_key(data)
+        bucket = bisect.bisect_left(self.bounds, latency)
+        with self._lock:
+            counters = self._counters.get(key)
+            if counters is None:
+                counters = _Counters(len(self.bounds) + 1)
+                self._counters[key] = counters
+            counters.count += 1
+            counters.timeouts += timeout
+            counters.errors += error is not None and not timeout
+            counters.bytes_out += len(data)
+            counters.bytes_in += _size(ans)
+            counters.total_latency += latency
+            counters.max_latency = max(counters.max_latency, latency)
+            counters.histogram[bucket] += 1
+
+    def _percentile(self, counters, percent):
+        rank = percent / 100 * counters.count
+        total = 0
+        for bound, count in zip(self.bounds, counters.histogram):
+            total += count
+            if total >= rank:
+                return min(bound, counters.max_latency)
+        return counters.max_latency
+
+    def _summary(self, counters):
+        summary = {name: getattr(counters, name) for name in
+                   ('count', 'errors', 'timeouts', 'bytes_out', 'bytes_in')}
+        summary['mean'] = counters.total_latency / max(counters.count, 1)
+        summary['max'] = counters.max_latency
+        for percent in self.PERCENTILES:
+            summary['p{}'.format(percent)] = (
+                self._percentile(counters, percent) if counters.count
+                else 0.0)
+        return summary
+
+    def commands(self):
+        """
+        Return the statistics by command: {command: {'count', 'errors',
+        'timeouts', 'bytes_out', 'bytes_in', 'mean', 'max', 'p50', 'p95',
+        'p99'}} (latencies in seconds)
+        """
+        with self._lock:
+            return {key: self._summary(counters)
+                    for key, counters in self._counters.items()}
+
+    def total(self):
+        """Return the statistics of all the commands (see commands())"""
+        total = _Counters(len(self.bounds) + 1)
+        with self._lock:
+            for counters in self._counters.values():
+                total.merge(counters)
+        return self._summary(total)
+
+
+class ManagedConn:
+    """
+    SyncConn surviving link failures (serial line or terminal server).
+
+    The port is opened on first use (or by connect()). After a timeout or
+    a partial answer the input is flushed and a ?VER probe brings the
+    link back to a known protocol state. If the probe fails the port is
+    closed and reopened by a background thread, with an exponential
+    backoff (retry_min to retry_max seconds). Meanwhile calls fail
+    immediately with a "disconnected" error instead of waiting for the
+    port. health is CONNECTED or DISCONNECTED.
+    """
+
+    CONNECTED = 'CONNECTED'
+    DISCONNECTED = 'DISCONNECTED'
+    PROBE = b'?VER\r'
+    PROBE_ANSWER = b'MOCO'
+
+    def __init__(self, url, timeout=1.5, probe_timeout=0.5, retry_min=0.5,
+                 retry_max=30.0, stats=None, recorder=None, **kwargs):
+        self.log = logging.getLogger('{}.ManagedConn'.format(__name__))
+        self.url = url
+        # kept across reconnections
+        self.stats = stats
+        self.recorder = recorder
+        self.timeout = timeout
+        self.probe_timeout = probe_timeout
+        self.retry_min = retry_min
+        self.retry_max = retry_max
+        self.kwargs = kwargs
+        self.health = self.DISCONNECTED
+        self.error = None
+        self.reconnections = 0
+        self._reconnect_callbacks = []
+        self._conn = None
+        self._connected_once = False
+        self._retry_delay = retry_min
+        self._retry_time = 0
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = None
+
+    @property
+    def connected_once(self):
+        """True once the link has been opened successfully"""
+        return self._connected_once
+
+    def close(self):
+        """Close the link for good (a pending reconnection is abandoned)"""
+        with self._lock:
+            self._closed.set()
+            conn, self._conn = self._conn, None
+        if conn is not None:
+            conn.close()
+        self.health = self.DISCONNECTED
+
+    def connect(self, wait=True):
+        """
+        Open the link now instead of on first use. With wait=False it is
+        opened by the background thread (see health and error)
+        """
+        if wait:
+            self._connect()
+        else:
+            with self._lock:
+                self._start_reconnection()
+
+    def add_reconnect_callback(self, func):
+        """
+        Call func() when the link is lost and after each reconnection: the
+        controller may have been reset or power cycled meanwhile
+        """
+        self._reconnect_callbacks.append(func)
+
+    def _link_changed(self):
+        for func in self._reconnect_callbacks:
+            try:
+                func()
+            except Exception:
+                self.log.exception('Error in reconnection callback')
+
+    def _connect(self):
+        if self._conn is not None:
+            return
+        with self._lock:
+            if self._closed.is_set():
+                raise Exception('Error: connection closed')
+            reconnecting = self._thread is not None or self._connected_once
+        if reconnecting:
+            raise Exception('Error: disconnected ({}), reconnecting in the '
+                            'background'.format(self.error or 'connecting'))
+        self._open()
+
+    def _open(self):
+        conn = None
+        try:
+            conn = SyncConn(self.url, timeout=self.timeout, stats=self.stats,
+                            recorder=self.recorder, **self.kwargs)
+            conn.resync(self.PROBE, self.PROBE_ANSWER, self.probe_timeout)
+        except Exception as error:
+            if conn is not None:
+                conn.close()
+            self._disconnect(error)
+            raise Exception('Error: cannot connect to {}: {}'.format(
+                self.url, error))
+        with self._lock:
+            if self._closed.is_set():
+                conn.close()
+                raise Exception('Error: connection closed')
+            self._conn = conn
+            reconnection = self._connected_once
+            self._connected_once = True
+            self.health = self.CONNECTED
+            self.error = None
+            self._retry_delay = self.retry_min
+        if reconnection:
+            self.reconnections += 1
+            self.log.warning('Reconnected to %s', self.url)
+            self._link_changed()
+
+    def _disconnect(self, error):
+        self.log.warning('Link to %s down (%s), next attempt in %.1f s',
+                         self.url, error, self._retry_delay)
+        with self._lock:
+            conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        self.health = self.DISCONNECTED
+        self.error = str(error)
+        self._link_changed()
+        with self._lock:
+            self._retry_time = time.monotonic() + self._retry_delay
+            self._retry_delay = min(2 * self._retry_delay, self.retry_max)
+            self._start_reconnection()
+
+    def _start_reconnection(self):
+        # called with the lock held
+        if self._thread is not None or self._closed.is_set():
+            return
+        self._thread = threading.Thread(target=self._reconnect,
+                                        name='MocoReconnect', daemon=True)
+        self._thread.start()
+
+    def _reconnect(self):
+        while True:
+            with self._lock:
+                if self._closed.is_set() or self._conn is not None:
+                    self._thread = None
+                    return
+                wait = self._retry_time - time.monotonic()
+            if wait > 0:
+                self._closed.wait(wait)
+                continue
+            try:
+                self._open()
+            except Exception:
+                # logged by _disconnect(), which scheduled the next attempt
+                pass
+
+    def _recover(self, conn, error):
+        try:
+            conn.resync(self.PROBE, self.PROBE_ANSWER, self.probe_timeout)
+        except Exception as probe_error:
+            self._disconnect(probe_error)
+        else:
+            self.log.warning('Resynchronized after: %s', error)
+
+    def _call(self, method, *args):
+        conn = self._conn
+        if conn is None:
+            self._connect()
+            conn = self._conn
+        try:
+            ans = getattr(conn, method)(*args)
+        except OSError as error:
+            # SerialException, socket errors and incomplete answers
+            self._recover(conn, error)
+            raise
+        if not _complete(ans):
+            error = TimeoutError('Incomplete answer: {!r}'.format(ans))
+            self._recover(conn, error)
+            raise error
         return ans
 
+    def write_raw(self, data):
+        return self._call('write_raw', data)
+
+    def write_readline(self, data):
+        return self._call('write_readline', data)
+
+    def write_readline_many(self, data, nb_lines):
+        return self._call('write_readline_many', data, nb_lines)
 
-class Moco:
+    def write_readlines(self, data):
+        return self._call('write_readlines', data)
 
-    def __init__(self, conn):
+    def write_readblocks(self, data, nb_answers):
+        return self._call('write_readblocks', data, nb_answers)
+
+    def write_readblocks_checked(self, data, nb_answers):
+        return self._call('write_readblocks_checked', data, nb_answers)
+
+
+class QueuedConn:
+    """
+    Thread safe connection. A single I/O worker thread owns the wrapped
+    connection and runs the queued transactions one at a time. Identical
+    requests waiting in the queue at the same time are merged into a
+    single transaction.
+
+    Each controller has its own worker: a slow or dead controller only
+    delays its own transactions. The latency (queueing included) of the
+    last LATENCY_SAMPLES transactions is kept, see latency().
+    """
+
+    LATENCY_SAMPLES = 100
+
+    def __init__(self, conn, name='MocoIO'):
+        self.log = logging.getLogger('{}.QueuedConn'.format(__name__))
         self.conn = conn
+        self._queue = queue.Queue()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        self._latencies = collections.deque(maxlen=self.LATENCY_SAMPLES)
+        self._worker = threading.Thread(target=self._run, name=name,
+                                        daemon=True)
+        self._worker.start()
+
+    @property
+    def pending(self):
+        """Number of transactions waiting for the worker"""
+        return self._queue.qsize()
+
+    def latency(self):
+        """
+        Return the (last, mean, max) latency in seconds of the recent
+        transactions (zeros if none)
+        """
+        latencies = list(self._latencies)
+        if not latencies:
+            return 0.0, 0.0, 0.0
+        return latencies[-1], sum(latencies) / len(latencies), max(latencies)
+
+    def _submit(self, method, *args):
+        key = method, args
+        # only requests ('?...') can be answered to several callers
+        merge = (method in ('write_readlines', 'write_readblocks_checked') and
+                 args[0].startswith(b'?'))
+        with self._lock:
+            if self._closed:
+                raise Exception('Error: connection closed')
+            future = self._pending.get(key) if merge else None
+            if future is None:
+                future = Future()
+                if merge:
+                    self._pending[key] = future
+                self._queue.put((key, future, time.monotonic()))
+        return future
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            key, future, submitted = item
+            with self._lock:
+                if self._pending.get(key) is future:
+                    del self._pending[key]
+            if not future.set_running_or_notify_cancel():
+                continue
+            method, args = key
+            try:
+                result = getattr(self.conn, method)(*args)
+            except BaseException as error:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+            self._latencies.append(time.monotonic() - submitted)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._queue.put(None)
+        self._worker.join()
+        self.conn.close()
+
+    def connect(self):
+        """
+        Open the wrapped connection from the worker thread, without
+        waiting. Return the Future of the connection.
+        """
+        return self._submit('connect')
+
+    def add_reconnect_callback(self, func):
+        """Forwarded to the wrapped connection, if it reconnects"""
+        add_callback = getattr(self.conn, 'add_reconnect_callback', None)
+        if add_callback is not None:
+            add_callback(func)
+
+    def write_raw(self, data):
+        return self._submit('write_raw', data).result()
+
+    def write_readline(self, data):
+        return self._submit('write_readline', data).result()
+
+    def write_readline_many(self, data, nb_lines):
+        return self._submit('write_readline_many', data, nb_lines).result()
+
+    def write_readlines(self, data):
+        return self._submit('write_readlines', data).result()
+
+    def write_readblocks(self, data, nb_answers):
+        return self._submit('write_readblocks', data, nb_answers).result()
+
+    def write_readblocks_checked(self, data, nb_answers):
+        return self._submit('write_readblocks_checked', data,
+                            nb_answers).result()
+
+
+class ParamCache:
+    """
+    Answers of the rarely changing requests, kept for ttls[name] seconds.
+
+    Successful writes of the numeric settings update the cached answer;
+    any other write of a cached setting (whose answer the controller may
+    format differently) drops it. RESET and TUNE drop everything.
+    """
+
+    TTLS = {
+        'INBEAM': 60.0,
+        'OUTBEAM': 60.0,
+        'MODE': 60.0,
+        'TAU': 60.0,
+        'SLOPE': 60.0,
+        'PHASE': 60.0,
+        'AMPLITUDE': 60.0,
+        'FREQUENCY': 60.0,
+        'SET': 60.0,
+    }
+    # settings answering the value written
+    WRITE_THROUGH = {'TAU', 'SLOPE', 'PHASE', 'AMPLITUDE', 'FREQUENCY'}
+    # commands changing the answer of another request
+    CHANGES = {'CLEAR': 'SET'}
+    # commands which may change any setting
+    CHANGES_ALL = {'RESET', 'TUNE'}
+
+    def __init__(self, ttls=None, clock=time.monotonic):
+        self.ttls = dict(self.TTLS if ttls is None else ttls)
+        self.clock = clock
+        self._values = {}
+        self._lock = threading.Lock()
+        # changed by every write: answers read across a write are dropped
+        self.generation = 0
+
+    def get(self, name):
+        """Return the cached answer of ?name or None"""
+        with self._lock:
+            value, expiry = self._values.get(name, (None, 0))
+        if self.clock() < expiry:
+            return value
+
+    def put(self, name, value, generation=None):
+        """
+        Cache the answer of ?name. generation is the one before the request
+        was sent.
+        """
+        ttl = self.ttls.get(name)
+        if not ttl:
+            return
+        with self._lock:
+            if generation is None or generation == self.generation:
+                self._values[name] = value, self.clock() + ttl
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._values.clear()
+
+    def forget(self, cmd):
+        """Drop the answers a (maybe failed) write command may change"""
+        words = cmd.split()
+        name = words[0].upper() if words else ''
+        if name in self.CHANGES_ALL:
+            self.clear()
+            return
+        with self._lock:
+            self.generation += 1
+            self._values.pop(name, None)
+            self._values.pop(self.CHANGES.get(name), None)
+
+    def written(self, cmd):
+        """Update the cache after a successful write command"""
+        self.forget(cmd)
+        words = cmd.split()
+        if len(words) == 2 and words[0].upper() in self.WRITE_THROUGH:
+            self.put(words[0].upper(), words[1])
+
+
+class Moco(_KnownSpeeds):
+
+    def __init__(self, conn, cache=None):
+        self.conn = conn
+        # optional ParamCache of the rarely changing settings
+        self.cache = cache
+        self._speeds = None
+        # batch() queues are per thread
+        self._local = threading.local()
+        add_callback = getattr(conn, 'add_reconnect_callback', None)
+        if add_callback is not None:
+            add_callback(self._reconnected)
 
     @classmethod
-    def for_url(cls, url, **kwargs):
-        conn = SyncConn(url, **kwargs)
-        return cls(conn)
+    def for_url(cls, url, queued=False, managed=False, cache=None,
+                **kwargs):
+        if managed:
+            conn = ManagedConn(url, **kwargs)
+        else:
+            conn = SyncConn(url, **kwargs)
+        if queued:
+            conn = QueuedConn(conn)
+        return cls(conn, cache)
+
+    @property
+    def _batch(self):
+        return getattr(self._local, 'batch', None)
+
+    @_batch.setter
+    def _batch(self, batch):
+        self._local.batch = batch
+
+    def _reconnected(self):
+        # the controller may have been reset or power cycled
+        self._speeds = None
+        if self.cache is not None:
+            self.cache.clear()
+
+    def _forget(self, cmds):
+        for cmd in cmds:
+            self._speeds = _known_speeds(self._speeds, cmd, ok=False)
+            if self.cache is not None:
+                self.cache.forget(cmd)
+
+    def _written(self, cmds):
+        for cmd in cmds:
+            self._speeds = _known_speeds(self._speeds, cmd)
+            if self.cache is not None:
+                self.cache.written(cmd)
 
     def write_cmd(self, cmd):
+        if self._batch is not None:
+            self._batch.append(cmd)
+            return
         data = '{}\r?ERR\r'.format(cmd)
-        ans = self.conn.write_readline(data.encode())
+        try:
+            ans = self.conn.write_readline(data.encode())
+        except Exception:
+            self._forget([cmd])
+            raise
         ans = ans.decode()
         ans = ans.strip('\r\n')
         if ans.lower() != 'ok':
+            self._forget([cmd])
             raise Exception('Error: {}'.format(ans))
+        self._written([cmd])
+
+    def write_cmds(self, cmds):
+        """
+        Send the commands back to back and read all their ?ERR answers in
+        a single pass. Raises reporting every command that failed.
+        """
+        cmds = list(cmds)
+        if not cmds:
+            return
+        data = ''.join('{}\r?ERR\r'.format(cmd) for cmd in cmds)
+        try:
+            answers = self.conn.write_readline_many(data.encode(), len(cmds))
+            _check_answers(cmds, answers)
+        except Exception:
+            self._forget(cmds)
+            raise
+        self._written(cmds)
+
+    @contextmanager
+    def batch(self):
+        """
+        Queue the write commands issued inside the context and send them
+        with write_cmds() on exit. Any read flushes the queued commands
+        first so the command order is preserved.
+        """
+        if self._batch is not None:
+            yield self
+            return
+        self._batch = []
+        try:
+            yield self
+            self.flush()
+        finally:
+            self._batch = None
+
+    def flush(self):
+        """Send the write commands queued by batch()"""
+        if self._batch:
+            cmds, self._batch = self._batch, []
+            self.write_cmds(cmds)
 
     def read_cmd(self, cmd):
-        MULTILINE_CMDS = ["HELP", "INFO"]
-        data = '?{}\r'.format(cmd)
-        if cmd in MULTILINE_CMDS:
-            lines = self.conn.write_readlines(data.encode())
-            ans = []
-            # Remove $ character used on multilines commands
-            for line in lines[1:-1]:
-                line = line.decode()
-                ans.append(line.strip('\r\n'))
-        else:
-            ans = self.conn.write_readline(data.encode())
-            ans = ans.decode()
-            ans = ans.strip('\r\n')
+        return self._read_cmd(cmd, '?{}\r'.format(cmd).encode())
+
+    def _read_cmd(self, cmd, data):
+        """read_cmd() of the already encoded request data"""
+        self.flush()
+        if self.cache is not None:
+            ans = self.cache.get(cmd)
+            if ans is not None:
+                return ans
+            generation = self.cache.generation
+        # Any request may get a '$' framed answer (e.g. ?HELP, ?INFO).
+        # The ?ERR of a failed request is read in the same transaction: a
+        # request of another thread could clear or replace the error
+        blocks = self.conn.write_readblocks_checked(data, 1)
+        ans = _decode_answer(blocks[0])
 
         if ans == 'ERROR':
-            err = self.conn.write_readline(b'?ERR\r')
-            err = err.decode()
+            err = blocks[-1][0].decode().strip('\r\n')
             raise Exception('Error: {}'.format(err))
+        if self.cache is not None:
+            self.cache.put(cmd, ans, generation)
         return ans
 
-    # ------------------------------------------------------------------------
-    #                           Attributes
-    # ------------------------------------------------------------------------
+    def read_cmds(self, cmds):
+        """
+        Send the requests back to back and read all their answers in a
+        single pass. Raises reporting every request that failed.
+        """
+        self.flush()
+        cmds = list(cmds)
+        if not cmds:
+            return []
+        data = ''.join('?{}\r'.format(cmd) for cmd in cmds)
+        blocks = self.conn.write_readblocks_checked(data.encode(), len(cmds))
+        answers = [_decode_answer(lines) for lines in blocks[:len(cmds)]]
+        failed = _failed_requests(cmds, answers)
+        if failed:
+            err = blocks[-1][0].decode()
+            err = err.strip('\r\n')
+            raise Exception('Error: {} (last error: {})'.format(failed, err))
+        if 'SPEED' in cmds:
+            scan_speed, move_speed = answers[cmds.index('SPEED')].split()
+            self._speeds = float(scan_speed), float(move_speed)
+        return answers
 
-    def in_beam_conf(self, conf=None):
-        if conf is None:
-            value = self.read_cmd('INBEAM')
-            return value
-        cmd = 'INBEAM {0}'.format(conf)
-        self.write_cmd(cmd)
+    def read_many(self, cmds):
+        """
+        Read several parameters (e.g. ['TAU', 'PHASE']) in a single burst.
+        Return a dict of the values decoded as their accessors do.
+        """
+        cmds = list(cmds)
+        answers = self.read_cmds(cmds)
+        values = {}
+        for cmd, ans in zip(cmds, answers):
+            param = PARAMS_BY_CMD.get(cmd)
+            values[cmd] = ans if param is None else param.decode(ans)
+        return values
 
-    def out_beam_conf(self, conf=None):
-        if conf is None:
-            value = self.read_cmd('OUTBEAM')
-            return value
-        cmd = 'OUTBEAM {0}'.format(conf)
-        self.write_cmd(cmd)
+    def snapshot(self):
+        """
+        Read all the parameters in a single burst. Return a dict with the
+        time of the readout and the values by command name, e.g.
+        {'time': 1600000000.0, 'values': {'TAU': 1.0, ...}}
+        """
+        timestamp = time.time()
+        return dict(time=timestamp, values=self.read_many(SNAPSHOT_CMDS))
 
-    def set_point(self, value=None):
-        if value is None:
-            value = float(self.read_cmd('SETPOINT'))
-            return value
-        cmd = 'SETPOINT {}'.format(value)
-        self.write_cmd(cmd)
+    def config(self):
+        """Read the settings of moco.commands.CONFIG_CMDS in one burst"""
+        return self.read_many(CONFIG_CMDS)
 
-    def mode(self, value=None):
-        if value is None:
-            value = self.read_cmd('MODE')
-            return value
-        cmd = 'MODE {}'.format(value)
-        self.write_cmd(cmd)
+    def apply_config(self, config):
+        """
+        Write the settings of config (as returned by config()) which
+        differ from the current ones, in a single burst. Return the
+        commands sent.
+        """
+        cmds = _config_cmds(self.config(), config)
+        self.write_cmds(cmds)
+        return cmds
 
-    def tau(self, value=None):
-        if value is None:
-            value = float(self.read_cmd('TAU'))
-            return value
-        cmd = 'TAU {}'.format(value)
-        self.write_cmd(cmd)
+    def save_config(self, filename):
+        """Save the settings to a JSON file and return them"""
+        config = self.config()
+        with open(filename, 'w') as fobj:
+            json.dump(config, fobj, indent=2, sort_keys=True)
+        return config
 
-    def soft_beam(self, value=None):
-        if value is None:
-            value = float(self.read_cmd('SOFTBEAM'))
-            return value
-        cmd = 'SOFTBEAM {0}'.format(float(value))
-        self.write_cmd(cmd)
+    def restore_config(self, filename):
+        """apply_config() of a file written by save_config()"""
+        with open(filename) as fobj:
+            config = json.load(fobj)
+        return self.apply_config(config)
 
-    def operation_flags(self):
-        value = self.read_cmd('SET')
-        return value
+    # ------------------------------------------------------------------------
+    #                           Attributes
+    # ------------------------------------------------------------------------
+    # The plain parameters (tau(), phase(), operation_flags()...) are
+    # generated from moco.commands.PARAMS, see _accessor()
 
     def beam(self):
         beam = self.read_cmd('BEAM')
@@ -137,38 +1037,48 @@ class Moco:
         fbeam_out = float(fbeam_out)
         return fbeam, fbeam_in, fbeam_out
 
-    def state(self):
-        value = self.read_cmd('STATE')
-        return value
-
-    def piezo(self, value=None):
-        if value is None:
-            value = float(self.read_cmd('PIEZO'))
-            return value
-        cmd = 'PIEZO {}'.format(value)
-        self.write_cmd(cmd)
-
     def speed(self, values=None):
         if values is None:
             scan_speed, move_speed = self.read_cmd('SPEED').split()
-            return float(scan_speed), float(move_speed)
+            self._speeds = float(scan_speed), float(move_speed)
+            return self._speeds
         str_values = ''
         for value in values:
             str_values += '{} '.format(str(value))
         cmd = 'SPEED {}'.format(str_values)
         self.write_cmd(cmd)
 
+    def speeds(self):
+        """
+        Return the (scan, move) speeds last read or written, only asking
+        the controller if they are not known yet
+        """
+        speeds = self._speeds
+        if speeds is None:
+            speeds = self.speed()
+        return speeds
+
+    def set_speeds(self, scan=None, move=None):
+        """Set the scan and/or move speeds with a single SPEED command"""
+        if move is None:
+            if scan is not None:
+                self.speed([scan])
+            return
+        if scan is None:
+            scan, _ = self.speeds()
+        self.speed([scan, move])
+
     def scan_speed(self, value=None):
         if value is None:
-            scan_speed, _ = self.speed()
+            scan_speed, _ = self.speeds()
             return scan_speed
-        self.speed([value])
+        self.set_speeds(scan=value)
 
     def move_speed(self, value=None):
-        scan_speed, move_speed = self.speed()
         if value is None:
+            _, move_speed = self.speeds()
             return move_speed
-        self.speed([scan_speed, value])
+        self.set_speeds(move=value)
 
     def osc_beam_signals(self):
         main_signal, quad_signal = self.read_cmd('OSCBEAM').split()
@@ -176,45 +1086,6 @@ class Moco:
         quad_signal = float(quad_signal)
         return main_signal, quad_signal
 
-    def phase(self, value=None):
-        if value is None:
-            value = float(self.read_cmd('PHASE'))
-            return value
-        cmd = 'PHASE {}'.format(value)
-        self.write_cmd(cmd)
-
-    def amplitude(self, value=None):
-        if value is None:
-            value = float(self.read_cmd('AMPLITUDE'))
-            return value
-        cmd = 'AMPLITUDE {}'.format(value)
-        self.write_cmd(cmd)
-
-    def frequency(self, value=None):
-        if value is None:
-            value = float(self.read_cmd('FREQUENCY'))
-            return value
-        cmd = 'FREQUENCY {}'.format(value)
-        self.write_cmd(cmd)
-
-    def slope(self, value=None):
-        if value is None:
-            value = float(self.read_cmd('SLOPE'))
-            return value
-        cmd = 'SLOPE {}'.format(value)
-        self.write_cmd(cmd)
-
-    def operation_flags(self):
-        value = self.read_cmd('SET').split()
-        return value
-
-    def oscil(self, value=None):
-        if value is None:
-            value = self.read_cmd('OSCIL')
-            return value
-        cmd = 'OSCIL {}'.format(value)
-        self.write_cmd(cmd)
-
     # ------------------------------------------------------------------------
     #                           Commands
     # ------------------------------------------------------------------------
@@ -244,10 +1115,30 @@ class Moco:
         cmd = 'CLEAR {}'.format(flags)
         self.write_cmd(cmd)
 
-    def info(self):
-        value = self.read_cmd('INFO')
-        return value
-
     def reset(self):
         # The reset command do not allow to check the error after
+        self.flush()
+        self._forget(['RESET'])
         self.conn.write_raw(b'RESET\r')
+
+
+def _accessor(param):
+    """Moco method reading (and writing, if given a value) param"""
+    cmd, query, decode, encode = (param.cmd, param.query, param.decode,
+                                  param.encode)
+    if param.read_only:
+        def accessor(self):
+            return decode(self._read_cmd(cmd, query))
+    else:
+        def accessor(self, value=None):
+            if value is None:
+                return decode(self._read_cmd(cmd, query))
+            self.write_cmd(encode(value))
+    accessor.__name__ = accessor.__qualname__ = param.name
+    accessor.__doc__ = '{} (?{})'.format(param.doc, cmd)
+    return accessor
+
+
+for _param in PARAMS:
+    if _param.name is not None:
+        setattr(Moco, _param.name, _accessor(_param))
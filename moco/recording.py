@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the MoCo project
+#
+# Copyright (c) 2020 ALBA controls team
+# Distributed under the GNU General Public License v3.
+# See LICENSE for more info.
+
+"""
+Recording and replay of the controller traffic.
+
+A Recorder given to SyncConn (or ManagedConn, Moco.for_url...) appends
+every transaction to a log file, one compact JSON array per line:
+
+    [<time>, ">", <method>, <data written>]
+    [<time>, "<", <command>, <answer>]     (or "!" and the error)
+
+The bytes are stored as latin-1 strings (answers keep the list structure
+of the SyncConn method). One recording file per connection.
+
+ReplayConn plays a recording back in place of a SyncConn, e.g.
+Moco(ReplayConn('beamline.log', scale=0)), and the mocoreplay:// serial
+URL (see moco.simulator.protocol_mocoreplay) does the same at the serial
+level, for the Tango server or the asyncio client.
+"""
+
+import json
+import time
+import threading
+import collections
+
+from .core import _command_key
+
+Transaction = collections.namedtuple(
+    'Transaction', 'method data answer error duration')
+
+# recorded error types raised again on replay (default OSError)
+ERRORS = {'TimeoutError': TimeoutError, 'Exception': Exception}
+
+
+def _text(data):
+    if isinstance(data, bytes):
+        return data.decode('latin-1')
+    if isinstance(data, list):
+        return [_text(item) for item in data]
+    return data
+
+
+def _bytes(data):
+    if isinstance(data, str):
+        return data.encode('latin-1')
+    if isinstance(data, list):
+        return [_bytes(item) for item in data]
+    return data
+
+
+def _flatten(answer):
+    if isinstance(answer, bytes):
+        return answer
+    if isinstance(answer, list):
+        return b''.join(_flatten(item) for item in answer)
+    return b''
+
+
+class Recorder:
+    """Append-only log of the transactions of a connection"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._file = open(filename, 'a')
+
+    def _write(self, record):
+        line = json.dumps(record, separators=(',', ':'))
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def request(self, method, data):
+        self._write([time.time(), '>', method, _text(data)])
+
+    def answer(self, data, answer):
+        self._write([time.time(), '<', _command_key(data), _text(answer)])
+
+    def error(self, data, error):
+        self._write([time.time(), '!', _command_key(data),
+                     '{}: {}'.format(type(error).__name__, error)])
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def load(filename):
+    """Return the list of Transactions of a Recorder file"""
+    transactions = []
+    request = None
+    with open(filename) as fobj:
+        for line_nb, line in enumerate(fobj, 1):
+            record = json.loads(line)
+            if record[1] == '>':
+                request = record
+                continue
+            if request is None:
+                raise Exception('Error: {}:{}: answer without request'.format(
+                    filename, line_nb))
+            start, _, method, data = request
+            answer, error = None, None
+            if record[1] == '!':
+                name, _, message = record[3].partition(': ')
+                error = ERRORS.get(name, OSError), message
+            else:
+                answer = _bytes(record[3])
+            transactions.append(Transaction(method, _bytes(data), answer,
+                                            error, record[0] - start))
+            request = None
+    return transactions
+
+
+class Recording:
+    """
+    Transactions of a recording file, in order or by data written (see
+    find()). scale multiplies the recorded durations (0: no waiting).
+    """
+
+    def __init__(self, filename, scale=1.0):
+        self.filename = filename
+        self.scale = scale
+        self.transactions = load(filename)
+        self._by_data = collections.defaultdict(collections.deque)
+        for transaction in self.transactions:
+            self._by_data[transaction.data].append(transaction)
+        self._lock = threading.Lock()
+
+    def find(self, data):
+        """
+        Return the next recorded transaction of data (answers of the same
+        request are played in turn, cycling) or None if there is none
+        """
+        with self._lock:
+            transactions = self._by_data.get(data)
+            if not transactions:
+                return None
+            transaction = transactions[0]
+            transactions.rotate(-1)
+        return transaction
+
+    def delay(self, transaction):
+        return transaction.duration * self.scale
+
+
+class ReplayConn:
+    """
+    Connection answering from a recording, usable as Moco(ReplayConn(...)).
+
+    strict requires the requests to come in the recorded order (raises
+    on any difference, for deterministic replays). Otherwise each request
+    gets the recorded answers of the same request, cycling. The recorded
+    transaction durations are waited for, multiplied by scale.
+    """
+
+    def __init__(self, filename, scale=1.0, strict=True):
+        self.recording = Recording(filename, scale)
+        self.strict = strict
+        self._index = 0
+        self._lock = threading.Lock()
+
+    def _next(self, method, data):
+        with self._lock:
+            # ManagedConn probes are replayed at the serial level only
+            while (self._index < len(self.recording.transactions) and
+                   self.recording.transactions[self._index].method ==
+                   'resync'):
+                self._index += 1
+            if self._index >= len(self.recording.transactions):
+                raise Exception('Error: end of the recording')
+            transaction = self.recording.transactions[self._index]
+            if (transaction.method, transaction.data) != (method, data):
+                raise Exception(
+                    'Error: replay diverged at transaction {}: expected '
+                    '{} {!r}, got {} {!r}'.format(
+                        self._index, transaction.method, transaction.data,
+                        method, data))
+            self._index += 1
+        return transaction
+
+    def _play(self, method, data):
+        if self.strict:
+            transaction = self._next(method, data)
+        else:
+            transaction = self.recording.find(data)
+            if transaction is None:
+                raise Exception('Error: no recorded answer to {!r}'.format(
+                    data))
+        delay = self.recording.delay(transaction)
+        if delay > 0:
+            time.sleep(delay)
+        if transaction.error is not None:
+            error_type, message = transaction.error
+            raise error_type(message)
+        return transaction.answer
+
+    def close(self):
+        pass
+
+    def write_raw(self, data):
+        self._play('write_raw', data)
+
+    def write_readline(self, data):
+        return self._play('write_readline', data)
+
+    def write_readline_many(self, data, nb_lines):
+        return self._play('write_readline_many', data)
+
+    def write_readlines(self, data):
+        return self._play('write_readlines', data)
+
+    def write_readblocks(self, data, nb_answers):
+        return self._play('write_readblocks', data)
+
+    def write_readblocks_checked(self, data, nb_answers):
+        return self._play('write_readblocks_checked', data)
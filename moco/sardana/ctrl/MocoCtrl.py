@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the MoCo project
+#
+# Copyright (c) 2020 ALBA controls team
+# Distributed under the GNU General Public License v3.
+# See LICENSE for more info.
+
+"""
+Sardana controllers of the MoCo, through its Tango device: the beam
+signals as counter/timer or 0D channels and the piezo as a motor.
+
+All the signals of an acquisition (or of a sample while integrating) are
+read with a single ReadSignals command, i.e. one serial burst.
+"""
+
+import time
+import threading
+
+import tango
+from sardana import State
+from sardana.pool import AcqSynch
+from sardana.pool.controller import (CounterTimerController, ZeroDController,
+                                     MotorController, Type, Description,
+                                     Access, DataAccess, DefaultValue)
+
+# axis (1 based) order of the ReadSignals command values after the time
+SIGNALS = ['Beam_In', 'Beam_Out', 'FBeam_In', 'FBeam_Out',
+           'OscBeamMainSignal', 'OscBeamQuadSignal', 'Piezo']
+
+# ?STATE (without PAUSED prefix) to piezo motor state
+PIEZO_STATES = {
+    'IDLE': State.On,
+    'MOVE': State.Moving,
+    'SCAN': State.Moving,
+    'SEARCH': State.Moving,
+    # the regulation drives the piezo
+    'RUN': State.Disable,
+    'WAITBEAM': State.On,
+    'WAIT': State.On,
+    'OVERLOAD': State.Alarm,
+    'ALARM': State.Alarm,
+}
+
+MOCO_DEVICE = {
+    'MocoDevice': {Type: str, Description: 'Moco Tango device name'},
+}
+
+# default seconds between the ReadSignals of the Sampler
+SAMPLE_PERIOD = 0.05
+
+
+class Sampler:
+    """
+    Background loop averaging the MoCo signals over repetitions windows
+    of integ_time seconds, latency_time apart, sampled every
+    sample_period seconds. The averages are appended to points as they
+    complete.
+    """
+
+    def __init__(self, device, integ_time, repetitions=1, latency_time=0,
+                 sample_period=SAMPLE_PERIOD):
+        self.device = device
+        self.integ_time = integ_time
+        self.repetitions = repetitions
+        self.cycle_time = integ_time + latency_time
+        self.sample_period = sample_period
+        self.points = []
+        self.error = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run,
+                                        name='MocoSampler', daemon=True)
+
+    @property
+    def running(self):
+        return self._thread.is_alive()
+
+    def start(self):
+        self.start_time = time.time()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.ident is not None:
+            self._thread.join()
+
+    def _run(self):
+        sums, count = [0.0] * len(SIGNALS), 0
+        try:
+            while len(self.points) < self.repetitions:
+                window_start = (self.start_time +
+                                len(self.points) * self.cycle_time)
+                window_end = window_start + self.integ_time
+                wait = window_start - time.time()
+                if wait > 0 and self._stop.wait(wait):
+                    return
+                if self._stop.is_set():
+                    return
+                sample_start = time.time()
+                signals = self.device.ReadSignals()[1:]
+                sums = [total + value for total, value in zip(sums, signals)]
+                count += 1
+                now = time.time()
+                # at least one sample per point
+                if now >= window_end:
+                    self.points.append([total / count for total in sums])
+                    sums, count = [0.0] * len(SIGNALS), 0
+                    continue
+                # do not load the device (and the controller link) with
+                # back to back reads: the last one ends the window
+                wait = min(sample_start + self.sample_period, window_end) - now
+                if wait > 0 and self._stop.wait(wait):
+                    return
+        except Exception as error:
+            self.error = error
+
+
+class MocoCounterTimerController(CounterTimerController):
+    """
+    Counter/timer channels of the MoCo signals. Axis 1 is the timer,
+    axes 2 to 8 are the SIGNALS, averaged over the integration time.
+
+    With software start synchronization (continuous scans) the points
+    are sampled in the background and read as buffers.
+    """
+
+    gender = 'CounterTimer'
+    model = 'MoCo'
+    organization = 'ALBA'
+
+    MaxDevice = len(SIGNALS) + 1
+    default_timer = 1
+
+    ctrl_properties = dict(MOCO_DEVICE, SamplePeriod={
+        Type: float, DefaultValue: SAMPLE_PERIOD,
+        Description: 'Seconds between the signal reads while integrating'})
+
+    def __init__(self, inst, props, *args, **kwargs):
+        CounterTimerController.__init__(self, inst, props, *args, **kwargs)
+        self.device = tango.DeviceProxy(self.MocoDevice)
+        self.integ_time = None
+        self.repetitions = 1
+        self.latency_time = 0
+        self.sampler = None
+        # points already returned by ReadOne per axis (buffered reads)
+        self.read_points = {}
+
+    def GetCtrlPar(self, par):
+        if par == 'synchronization':
+            return self._synchronization
+        elif par == 'latency_time':
+            return 0.0
+
+    def SetCtrlPar(self, par, value):
+        if par == 'synchronization':
+            if value not in (AcqSynch.SoftwareTrigger, AcqSynch.SoftwareGate,
+                             AcqSynch.SoftwareStart):
+                raise Exception('Error: only software synchronization '
+                                'is supported')
+            self._synchronization = value
+
+    def LoadOne(self, axis, value, repetitions, latency_time):
+        if value <= 0:
+            raise Exception('Error: counting to a monitor is not supported')
+        self.integ_time = value
+        self.repetitions = repetitions
+        self.latency_time = latency_time
+
+    def StartAll(self):
+        if self.sampler is not None:
+            self.sampler.stop()
+        self.read_points = {}
+        self.sampler = Sampler(self.device, self.integ_time,
+                               self.repetitions, self.latency_time,
+                               self.SamplePeriod)
+        self.sampler.start()
+
+    def StateOne(self, axis):
+        sampler = self.sampler
+        if sampler is None:
+            return State.On, 'Ready'
+        if sampler.error is not None:
+            return State.Fault, 'Error reading the signals: {}'.format(
+                sampler.error)
+        if sampler.running:
+            return State.Moving, 'Acquiring'
+        return State.On, 'Ready'
+
+    def _value(self, axis, point):
+        if axis == 1:
+            return self.integ_time
+        return point[axis - 2]
+
+    def ReadOne(self, axis):
+        sampler = self.sampler
+        if sampler is None:
+            return None
+        points = sampler.points[:]
+        if self._synchronization == AcqSynch.SoftwareStart:
+            first = self.read_points.get(axis, 0)
+            self.read_points[axis] = len(points)
+            return [self._value(axis, point) for point in points[first:]]
+        if not points:
+            return None
+        return self._value(axis, points[-1])
+
+    def AbortOne(self, axis):
+        if self.sampler is not None:
+            self.sampler.stop()
+
+
+class MocoZeroDController(ZeroDController):
+    """
+    0D channels of the MoCo SIGNALS (axes 1 to 7). All the channels of a
+    read cycle share a single ReadSignals command.
+    """
+
+    gender = 'ZeroD'
+    model = 'MoCo'
+    organization = 'ALBA'
+
+    MaxDevice = len(SIGNALS)
+
+    ctrl_properties = MOCO_DEVICE
+
+    def __init__(self, inst, props, *args, **kwargs):
+        ZeroDController.__init__(self, inst, props, *args, **kwargs)
+        self.device = tango.DeviceProxy(self.MocoDevice)
+        self.signals = None
+
+    def StateOne(self, axis):
+        return State.On, 'Ready'
+
+    def PreReadAll(self):
+        self.signals = None
+
+    def ReadAll(self):
+        self.signals = self.device.ReadSignals()[1:]
+
+    def ReadOne(self, axis):
+        return self.signals[axis - 1]
+
+
+class MocoPiezoController(MotorController):
+    """
+    The MoCo piezo output (PIEZO, in V) as a single axis motor. The
+    velocity is the controller move speed (the scan speed is the ScanSpeed
+    axis attribute). The motion state comes from ?STATE.
+
+    Continuous scans (ascanct) of the piezo can sample the beam signals
+    with the MocoCounterTimerController channels.
+    """
+
+    gender = 'Motor'
+    model = 'MoCo piezo'
+    organization = 'ALBA'
+
+    MaxDevice = 1
+
+    ctrl_properties = MOCO_DEVICE
+
+    axis_attributes = {
+        'ScanSpeed': {
+            Type: float,
+            Access: DataAccess.ReadWrite,
+            Description: 'Controller scan speed (V/s) used by TUNE and GO',
+        },
+    }
+
+    def __init__(self, inst, props, *args, **kwargs):
+        MotorController.__init__(self, inst, props, *args, **kwargs)
+        self.device = tango.DeviceProxy(self.MocoDevice)
+        # the piezo speed changes instantly
+        self.acceleration = 0.0
+
+    def StateOne(self, axis):
+        moco_state = self.device.MocoState
+        words = moco_state.split()
+        state = PIEZO_STATES.get(words[-1] if words else '', State.Unknown)
+        return state, 'Controller state: {}'.format(moco_state), \
+            MotorController.NoLimitSwitch
+
+    def ReadOne(self, axis):
+        return self.device.Piezo
+
+    def StartOne(self, axis, position):
+        self.device.write_attribute('Piezo', position)
+
+    def StopOne(self, axis):
+        self.device.Stop()
+
+    def AbortOne(self, axis):
+        self.device.Stop()
+
+    def GetAxisPar(self, axis, name):
+        name = name.lower()
+        if name == 'velocity':
+            return self.device.MoveSpeed
+        if name in ('acceleration', 'deceleration'):
+            return self.acceleration
+        if name == 'base_rate':
+            return 0.0
+        if name == 'step_per_unit':
+            return 1.0
+        return MotorController.GetAxisPar(self, axis, name)
+
+    def SetAxisPar(self, axis, name, value):
+        name = name.lower()
+        if name == 'velocity':
+            self.device.write_attribute('MoveSpeed', value)
+        elif name in ('acceleration', 'deceleration'):
+            self.acceleration = value
+        elif name in ('base_rate', 'step_per_unit'):
+            pass
+        else:
+            MotorController.SetAxisPar(self, axis, name, value)
+
+    def GetAxisExtraPar(self, axis, name):
+        if name.lower() == 'scanspeed':
+            return self.device.ScanSpeed
+        return MotorController.GetAxisExtraPar(self, axis, name)
+
+    def SetAxisExtraPar(self, axis, name, value):
+        if name.lower() == 'scanspeed':
+            self.device.write_attribute('ScanSpeed', value)
+        else:
+            MotorController.SetAxisExtraPar(self, axis, name, value)
@@ -6,6 +6,8 @@
 # Distributed under the GNU General Public License v3.
 # See LICENSE for more info.
 
+import os
+import json
 import functools
 import tango
 from contextlib import contextmanager
@@ -13,23 +15,27 @@ from click import style
 
 from sardana.macroserver.macro import Type, macro, Optional
 
+from moco.commands import PARAMS
+
 TangoDevice = functools.lru_cache(maxsize=512)(tango.DeviceProxy)
 
 
+@functools.lru_cache(maxsize=None)
 def get_device_names_by_class(class_name, server="*"):
     """
-    Return list of device names for the given class name
-    The list can be filtered by server. By default the
-    search is performed on all servers.
+    Return the device names for the given class name.
+    The list can be filtered by server (wildcards allowed). By default
+    the search is performed on all servers.
+    The result is cached: see invalidate_device_names()
     """
     db = tango.Database()
-    result = []
-    for server_name in db.get_server_list(server):
-        dev_class = db.get_device_class_list(server_name)
-        for dname, cname in zip(dev_class[::2], dev_class[1::2]):
-            if cname == class_name:
-                result.append(dname)
-    return result
+    # a single DB query (DbGetDeviceList) instead of one per server
+    return tuple(db.get_device_name(server, class_name).value_string)
+
+
+def invalidate_device_names():
+    """Forget the devices found by get_device_names_by_class()"""
+    get_device_names_by_class.cache_clear()
 
 
 def get_device_name_by_class(class_name, server="*"):
@@ -44,13 +50,13 @@ def get_device_name_by_class(class_name, server="*"):
             return devices[0]
         else:
             raise ValueError(
-                "More than one device of type {!} found".format(class_name)
+                "More than one device of type {!r} found: {}. Select one "
+                "with moco_select".format(class_name, ", ".join(devices))
             )
     else:
         raise ValueError("No device of type {!r} found".format(class_name))
 
 
-
 @contextmanager
 def output_context(macro, message):
     """
@@ -73,10 +79,24 @@ def output_context(macro, message):
 
 class Moco:
 
+    # servers searched for Moco devices
+    SERVER = "Moco/*"
+
     def __init__(self, name=None):
+        # found on first use if not given
+        self._name = name
+
+    @property
+    def name(self):
+        if self._name is None:
+            self._name = get_device_name_by_class("Moco", self.SERVER)
+        return self._name
+
+    def select(self, name=None):
+        """Use the device name (None: find the Moco device again)"""
         if name is None:
-            name = get_device_name_by_class("Moco", "Moco/*")
-        self.name = name
+            invalidate_device_names()
+        self._name = name
 
     @property
     def device(self):
@@ -96,6 +116,47 @@ class Moco:
 moco = Moco()
 
 
+def _param_macro(param):
+    """Macro setting/reading the Tango attribute of a moco.commands.Param"""
+    attr = param.attr
+    param_type = Type.Float if param.dtype is float else Type.String
+
+    def param_macro(self, value):
+        if value is not None:
+            with output_context(self, 'Moco setting {} "{}"...'.format(
+                    attr, value)):
+                moco.write_attribute(attr, value)
+        else:
+            with output_context(self, 'Moco reading {}...'.format(attr)):
+                return moco.read_attribute(attr).value
+
+    param_macro.__name__ = param.macro
+    param_macro.__doc__ = 'Set/query the Moco {} (?{}/{})'.format(
+        param.doc, param.cmd, param.cmd)
+    decorator = macro(
+        param_def=[[param.macro_arg, param_type, Optional,
+                    'Set {}'.format(attr)]],
+        result_def=[[param.macro_arg, param_type, None,
+                     'Current {}'.format(attr)]])
+    return decorator(param_macro)
+
+
+# moco_tau, moco_piezo, moco_inbeam_conf... are generated from
+# moco.commands.PARAMS
+for _param in PARAMS:
+    if _param.macro is not None:
+        globals()[_param.macro] = _param_macro(_param)
+
+
+@macro(param_def=[['name', Type.String, Optional,
+                   'Moco device to use (default: find it again)']])
+def moco_select(self, name):
+    moco.select(name)
+    names = get_device_names_by_class("Moco", Moco.SERVER)
+    self.output('Moco devices: {}'.format(', '.join(names) or 'none'))
+    self.output('Selected: {}'.format(moco.name))
+
+
 @macro()
 def moco_info(self):
     with output_context(self, 'Moco reading status info...'):
@@ -121,32 +182,6 @@ def moco_stop(self):
         moco.stop()
 
 
-@macro(param_def=[['config', Type.String, Optional,
-                  'Configuration parameter see INBEAM/?INBEAM command']],
-       result_def=[['config', Type.String, None, 'Current configuration']])
-def moco_inbeam_conf(self, config):
-    if config is not None:
-        with output_context(self, 'Moco setting InBeamConfig "{}"...'.format(
-                config)):
-            moco.write_attribute('InBeamConf', config)
-    else:
-        with output_context(self, 'Moco reading InBeamConfig...'):
-            return moco.InBeamConf
-
-
-@macro(param_def=[['config', Type.String, Optional,
-                  'Configuration parameter see OUTBEAM/?OUTBEAM command']],
-       result_def=[['config', Type.String, None, 'Current configuration']])
-def moco_outbeam_conf(self, config):
-    if config is not None:
-        with output_context(self, 'Moco setting OutBeamConfig "{}"...'.format(
-                config)):
-            moco.write_attribute('OutBeamConf', config)
-    else:
-        with output_context(self, 'Moco reading OutBeamConfig...'):
-            return moco.InBeamConf
-
-
 @macro(param_def=[['cmd', Type.String, None, 'Command to send']])
 def moco_cmd(self, cmd):
     with output_context(self, 'Moco running OnlineCommand "{}"'.format(
@@ -157,67 +192,6 @@ def moco_cmd(self, cmd):
         return moco.OnlineCmd(cmd)
 
 
-@macro(param_def=[['pos', Type.Float, Optional, 'Position to set']],
-       result_def=[['pos', Type.Float, None, 'Current position']])
-def moco_piezo(self, pos):
-    if pos is not None:
-        with output_context(self, 'Moco setting Piezo "{}"...'.format(
-                pos)):
-            moco.write_attribute('piezo', pos)
-    else:
-        with output_context(self, 'Moco reading Piezo...'):
-            return moco.piezo
-
-
-@macro(param_def=[['freq', Type.Float, Optional, 'Set Frequency']],
-       result_def=[['freq', Type.Float, None, 'Current frequency']])
-def moco_frequency(self, freq):
-    if freq is not None:
-        with output_context(self, 'Moco setting Frequency "{}"...'.format(
-                freq)):
-            moco.write_attribute('Frequency', freq)
-    else:
-        with output_context(self, 'Moco reading Frequency...'):
-            return moco.frequency
-
-
-@macro(param_def=[['phase', Type.Float, Optional, 'Set Phase']],
-       result_def=[['phase', Type.Float, None, 'Current Phase']])
-def moco_phase(self, phase):
-    if phase is not None:
-        with output_context(self, 'Moco setting Phase "{}"...'.format(
-                phase)):
-            moco.write_attribute('Phase', phase)
-    else:
-        with output_context(self, 'Moco reading Phase...'):
-            return moco.phase
-
-
-
-@macro(param_def=[['mode', Type.String, Optional, 'Set Mode']],
-       result_def=[['mode', Type.String, None, 'Current Mode']])
-def moco_mode(self, mode):
-    if mode is not None:
-        with output_context(self, 'Moco setting Mode "{}"...'.format(
-                mode)):
-            moco.write_attribute('Mode', mode)
-    else:
-        with output_context(self, 'Moco reading Mode...'):
-            return moco.mode
-
-
-@macro(param_def=[['softbeam', Type.Float, Optional, 'Set SoftBeam']],
-       result_def=[['softbeam', Type.Float, None, 'Current SoftBeam']])
-def moco_softbeam(self, softbeam):
-    if softbeam is not None:
-        with output_context(self, 'Moco setting SoftBeam "{}"...'.format(
-                softbeam)):
-            moco.write_attribute('Softbeam', softbeam)
-    else:
-        with output_context(self, 'Moco reading Softbeam...'):
-            return moco.mode
-
-
 @macro(param_def=[['speed', Type.Float, Optional, 'Set MoveSpeed']],
        result_def=[['speed', Type.Float, None, 'Current MoveSpeed']])
 def moco_movespeed(self, speed):
@@ -268,3 +242,182 @@ def moco_clear_operationflags(self, flags):
                 flags)):
             moco.clearoperationflags(flags)
 
+
+@macro(param_def=[['filename', Type.String, None, 'JSON file to write']])
+def moco_save_config(self, filename):
+    with output_context(self, 'Moco saving configuration to {}...'.format(
+            filename)):
+        config = json.loads(moco.GetConfig())
+        with open(filename, 'w') as fobj:
+            json.dump(config, fobj, indent=2, sort_keys=True)
+
+
+@macro(param_def=[['filename', Type.String, None,
+                   'JSON file written by moco_save_config']])
+def moco_restore_config(self, filename):
+    with open(filename) as fobj:
+        config = json.load(fobj)
+    with output_context(self, 'Moco restoring configuration from '
+                              '{}...'.format(filename)):
+        cmds = moco.ApplyConfig(json.dumps(config))
+    if cmds:
+        self.output('\n'.join(cmds))
+    else:
+        self.output('Moco configuration already up to date')
+
+
+# Several Moco devices (e.g. DCM and mirrors) at once. Each request is sent
+# to all the devices with an asynchronous call before any reply is waited
+# for, so that N devices take a single round-trip time.
+
+def group_devices(macro, names):
+    """
+    Return the Moco device names of names. An item can be a device name,
+    a group of the MocoGroups environment variable ({group: [devices]})
+    or "all" (all the Moco devices).
+    """
+    try:
+        groups = macro.getEnv('MocoGroups')
+    except Exception:
+        groups = {}
+    devices = []
+    for name in names or ['all']:
+        if name.lower() == 'all':
+            found = get_device_names_by_class("Moco", Moco.SERVER)
+        elif name in groups:
+            found = groups[name]
+        else:
+            found = [name]
+        devices.extend(dev for dev in found if dev not in devices)
+    if not devices:
+        raise ValueError("No Moco device found")
+    return devices
+
+
+def _parallel(devices, start, reply, *args):
+    """
+    Call the asynchronous DeviceProxy method start(*args) on all the
+    devices, then collect the answers with reply(). Return a {device:
+    answer} dict, the answer being the exception if the call failed.
+    """
+    requests = []
+    for name in devices:
+        try:
+            device = TangoDevice(name)
+            requests.append((name, device, getattr(device, start)(*args)))
+        except Exception as error:
+            requests.append((name, None, error))
+    answers = {}
+    for name, device, request in requests:
+        if device is None:
+            answers[name] = request
+            continue
+        try:
+            answers[name] = getattr(device, reply)(
+                request, device.get_timeout_millis())
+        except Exception as error:
+            answers[name] = error
+    return answers
+
+
+def group_command(devices, cmd, *args):
+    """Run the Tango command on all the devices in parallel"""
+    return _parallel(devices, 'command_inout_asynch', 'command_inout_reply',
+                     cmd, *args)
+
+
+def group_read(devices, attrs):
+    """Read the Tango attributes of all the devices in parallel"""
+    answers = _parallel(devices, 'read_attributes_asynch',
+                        'read_attributes_reply', attrs)
+    return {name: answer if isinstance(answer, Exception)
+            else [value.value for value in answer]
+            for name, answer in answers.items()}
+
+
+def _error_text(error):
+    if isinstance(error, tango.DevFailed):
+        return error.args[0].desc.strip()
+    return str(error)
+
+
+def _output_group(macro, answers, fmt=str):
+    """
+    Output one line per device: fmt(answer) or the error. Raise if any
+    of the devices failed.
+    """
+    width = max(len(name) for name in answers)
+    failed = []
+    for name, answer in answers.items():
+        if isinstance(answer, Exception):
+            failed.append(name)
+            text = style('ERROR: {}'.format(_error_text(answer)), fg='red')
+        else:
+            text = fmt(answer)
+        macro.output('{}  {}'.format(name.ljust(width), text))
+    if failed:
+        raise Exception('Error: {} of {} Moco devices failed: {}'.format(
+            len(failed), len(answers), ', '.join(failed)))
+
+
+GROUP_PARAM = ['devices', [['device', Type.String, None,
+                            'Moco device, MocoGroups group or "all"'],
+                           {'min': 0}], None, 'Moco devices (default: all)']
+
+
+@macro(param_def=[GROUP_PARAM])
+def moco_group_status(self, devices):
+    answers = group_read(group_devices(self, devices), ['MocoState'])
+    _output_group(self, answers, lambda values: values[0])
+
+
+def _group_command_macro(cmd, doc):
+    def group_command_macro(self, devices):
+        answers = group_command(group_devices(self, devices), cmd)
+        _output_group(self, answers, lambda _: style('DONE', fg='green'))
+
+    group_command_macro.__name__ = 'moco_group_{}'.format(cmd.lower())
+    group_command_macro.__doc__ = doc
+    return macro(param_def=[GROUP_PARAM])(group_command_macro)
+
+
+moco_group_go = _group_command_macro('Go', 'Send GO to the Moco devices')
+moco_group_stop = _group_command_macro('Stop', 'Stop the Moco devices')
+moco_group_tune = _group_command_macro('Tune', 'Send TUNE to the Moco devices')
+
+
+@macro(param_def=[GROUP_PARAM])
+def moco_group_signals(self, devices):
+    """Read the beam signals and the piezo of the Moco devices"""
+    answers = group_command(group_devices(self, devices), 'ReadSignals')
+    names = ['beam_in', 'beam_out', 'fbeam_in', 'fbeam_out', 'osc_main',
+             'osc_quad', 'piezo']
+    _output_group(self, answers, lambda signals: '  '.join(
+        '{}={:g}'.format(name, value)
+        for name, value in zip(names, signals[1:])))
+
+
+@macro(param_def=[['directory', Type.String, None,
+                   'Directory of the <device>.json files to write'],
+                  GROUP_PARAM])
+def moco_group_save_config(self, directory, devices):
+    """
+    Save the configuration of each Moco device to a JSON file (named
+    after the device, readable by moco_restore_config)
+    """
+    answers = group_command(group_devices(self, devices), 'GetConfig')
+
+    def save(name, answer):
+        if isinstance(answer, Exception):
+            return answer
+        filename = os.path.join(directory,
+                                '{}.json'.format(name.replace('/', '_')))
+        try:
+            with open(filename, 'w') as fobj:
+                json.dump(json.loads(answer), fobj, indent=2, sort_keys=True)
+        except Exception as error:
+            return error
+        return filename
+
+    _output_group(self, {name: save(name, answer)
+                         for name, answer in answers.items()})
@@ -0,0 +1,428 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the MoCo project
+#
+# Copyright (c) 2020 ALBA controls team
+# Distributed under the GNU General Public License v3.
+# See LICENSE for more info.
+
+"""
+MoCo simulator.
+
+MocoSim implements the (noecho mode) serial protocol and a simple model of
+the optics: the OUTBEAM signal follows a gaussian rocking curve of the piezo
+voltage whose center slowly drifts, so that TUNE, GO and OSCIL give
+plausible results.
+
+It can be reached in two ways:
+
+* in-process through the pyserial ``mocosim://`` URL (e.g.
+  ``Moco.for_url('mocosim://?latency=0.002&byte_time=0.00104')``).
+  Options: ``latency`` (seconds per request), ``byte_time`` (seconds per
+  transmitted byte, 0.00104 emulates 9600 baud) and any MocoSim parameter.
+
+* over ``socket://`` with the ``simulator`` extra (sinstruments)::
+
+    # moco.yml
+    devices:
+    - class: Moco
+      name: moco1
+      package: moco.simulator.device
+      latency: 0.002
+      model:
+        center: 4.5
+      transports:
+      - type: tcp
+        url: :9001
+
+    $ sinstruments-server -c moco.yml
+"""
+
+import math
+import time
+import random
+
+VERSION = 'MOCO 01.02'
+
+FLAGS = ('NORMALISE', 'BEAMCHECK', 'AUTORUN', 'AUTORANGE', 'INTERLOCK')
+SIDES = ('LEFT', 'RIGHT')
+
+# settings stored as given (upper case) and returned by the ?<NAME> request
+DEFAULT_SETTINGS = {
+    'NAME': '"no name"',
+    'ADDR': '',
+    'OPRANGE': '0 10 0',
+    'SRANGE': '0 10',
+    'INBEAM': 'SOFT 1',
+    'OUTBEAM': 'EXT NORM UNIP 1.25e-08 AUTO',
+    'MODE': 'INTENSITY',
+    'PEAK': '1 0.1 0',
+    'AUTOTUNE': 'OFF',
+    'AUTOPEAK': 'OFF',
+    'BEAMCHECK': '0 0.333333 1.024 0',
+    'INHIBIT': 'OFF LOW',
+    'OSCIL': 'OFF',
+    'PAUSE': 'OFF',
+}
+
+# numeric settings
+DEFAULT_VALUES = {
+    'SETPOINT': 0.8,
+    'TAU': 1.0,
+    'SOFTBEAM': 1.0,
+    'PHASE': 0.0,
+    'AMPLITUDE': 0.1,
+    'FREQUENCY': 166.6,
+    'SLOPE': 0.0362,
+}
+
+HELP = (
+    'RESET', 'GO', 'STOP', 'TUNE', 'AUTOTUNE ?AUTOTUNE', 'AUTOPEAK ?AUTOPEAK',
+    'PIEZO ?PIEZO', '?STATE', '?BEAM', '?FBEAM', '?OSCBEAM',
+    'SOFTBEAM ?SOFTBEAM', 'OPRANGE ?OPRANGE', 'SRANGE ?SRANGE', 'SET ?SET',
+    'CLEAR ?CLEAR', 'PAUSE ?PAUSE', 'INHIBIT ?INHIBIT', 'TAU ?TAU',
+    'SETPOINT ?SETPOINT', 'MODE ?MODE', 'INBEAM ?INBEAM', 'OUTBEAM ?OUTBEAM',
+    'BEAMCHECK ?BEAMCHECK', 'SPEED ?SPEED', 'PEAK ?PEAK', 'SLOPE ?SLOPE',
+    'PHASE ?PHASE', 'AMPLITUDE ?AMPLITUDE', 'FREQUENCY ?FREQUENCY',
+    'OSCIL ?OSCIL', '?INFO', 'ECHO', 'NOECHO', '?ERR', 'ADDR ?ADDR',
+    'NAME ?NAME', '?VER', '?HELP',
+)
+
+INFO_SETTINGS = (
+    'NAME', 'ADDR', 'OPRANGE', 'INBEAM', 'OUTBEAM', 'MODE', 'PEAK',
+    'SETPOINT', 'TAU', 'SET', 'CLEAR', 'AUTOTUNE', 'AUTOPEAK', 'BEAMCHECK',
+    'SRANGE', 'SPEED', 'INHIBIT',
+)
+
+ERR_OK = 'OK'
+ERR_UNKNOWN = 'Command not recognised.'
+ERR_NB_PARAMS = 'Wrong Number of Parameter(s).'
+ERR_PARAM = 'Wrong Parameter(s).'
+
+
+class SimError(Exception):
+    pass
+
+
+def _format(value):
+    return '{:g}'.format(value)
+
+
+class MocoSim:
+    """
+    MoCo protocol and optics model.
+
+    Beam model parameters: ``center`` (V) and ``width`` (V) of the rocking
+    curve, ``drift`` amplitude (V) and ``drift_period`` (s) of the center,
+    ``in_beam`` (A) incoming intensity, ``out_beam`` (A) outgoing intensity
+    at the peak and ``noise`` relative noise of the beam signals.
+    """
+
+    def __init__(self, center=5.0, width=1.0, drift=0.05, drift_period=60.0,
+                 in_beam=1e-7, out_beam=1e-7, noise=1e-3, seed=None,
+                 clock=time.monotonic):
+        self.center = float(center)
+        self.width = float(width)
+        self.drift = float(drift)
+        self.drift_period = float(drift_period)
+        self.in_beam = float(in_beam)
+        self.out_beam = float(out_beam)
+        self.noise = float(noise)
+        self.clock = clock
+        self._random = random.Random(seed)
+        self._t0 = clock()
+        self._buffer = b''
+        self.reset()
+
+    # ------------------------------------------------------------------------
+    #                           Model
+    # ------------------------------------------------------------------------
+
+    def reset(self):
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.values = dict(DEFAULT_VALUES)
+        self.flags = ['RIGHT', 'BEAMCHECK', 'NORMALISE']
+        self.speed = [2.0, 50.0]
+        self.error = ERR_OK
+        self.state = 'IDLE'
+        self.piezo = 0.0
+        self._target = None
+        self._program = []
+        self._last = self.clock()
+
+    def _center(self, now):
+        phase = 2 * math.pi * (now - self._t0) / self.drift_period
+        return self.center + self.drift * math.sin(phase)
+
+    def _curve(self, piezo, now):
+        x = (piezo - self._center(now)) / self.width
+        return math.exp(-x * x / 2)
+
+    def _operation_point(self, now):
+        """Piezo voltage where the curve crosses the setpoint"""
+        setpoint = min(max(self.values['SETPOINT'], 1e-6), 1.0)
+        offset = self.width * math.sqrt(-2 * math.log(setpoint))
+        if 'LEFT' in self.flags:
+            offset = -offset
+        return self._center(now) + offset
+
+    def _scan_range(self):
+        low, high = self.settings['SRANGE'].split()[:2]
+        return float(low), float(high)
+
+    def _start(self, program):
+        """Run a sequence of (state, target, speed) ramps"""
+        self._program = list(program)
+        self._next_step()
+
+    def _next_step(self):
+        if self._program:
+            self.state, self._target, self._speed = self._program.pop(0)
+        else:
+            self._target = None
+
+    def update(self):
+        """Advance the model up to the current time"""
+        now = self.clock()
+        dt, self._last = now - self._last, now
+        if self.settings['PAUSE'] == 'ON':
+            return
+        while dt > 0 and self._target is not None:
+            target = self._target
+            if callable(target):
+                target = target(now)
+            distance = target - self.piezo
+            step = self._speed * dt
+            if abs(distance) > step:
+                self.piezo += math.copysign(step, distance)
+                dt = 0
+            else:
+                self.piezo = target
+                dt -= abs(distance) / self._speed
+                if self.state == 'SCAN':
+                    self._peak_found(now)
+                self._next_step()
+        if self.state in ('SEARCH', 'RUN') and self._target is None:
+            # regulation: first order approach to the operation point
+            self.state = 'RUN'
+            target = self._operation_point(now)
+            tau = max(self.values['TAU'], 1e-3)
+            self.piezo += (target - self.piezo) * (1 - math.exp(-dt / tau))
+        elif self._target is None:
+            self.state = 'IDLE'
+
+    def _peak_found(self, now):
+        peak = self.out_beam / self.in_beam
+        self.settings['PEAK'] = '{} {} 0'.format(
+            _format(peak), _format(self.width))
+
+    def beam(self):
+        now = self.clock()
+        in_beam = self.in_beam
+        if self.settings['INBEAM'].startswith('SOFT'):
+            in_beam = self.values['SOFTBEAM']
+        out_beam = self.out_beam * self._curve(self.piezo, now)
+        if self.settings['OSCIL'] == 'ON':
+            phase = 2 * math.pi * self.values['FREQUENCY'] * now
+            piezo = self.piezo + self.values['AMPLITUDE'] * math.sin(phase)
+            out_beam = self.out_beam * self._curve(piezo, now)
+        out_beam *= 1 + self._random.gauss(0, self.noise)
+        return in_beam, out_beam
+
+    def fbeam(self):
+        now = self.clock()
+        in_beam, _ = self.beam()
+        return in_beam, self.out_beam * self._curve(self.piezo, now)
+
+    def osc_beam(self):
+        if self.settings['OSCIL'] != 'ON':
+            return 0.0, 0.0
+        now = self.clock()
+        x = (self.piezo - self._center(now)) / self.width
+        # first harmonic of the outgoing signal: slope of the curve
+        derivative = -x / self.width * self._curve(self.piezo, now)
+        signal = self.values['AMPLITUDE'] * derivative
+        phase = math.radians(self.values['PHASE'])
+        noise = self._random.gauss(0, self.noise) * abs(signal)
+        return signal * math.cos(phase), signal * math.sin(phase) + noise
+
+    # ------------------------------------------------------------------------
+    #                           Protocol
+    # ------------------------------------------------------------------------
+
+    def feed(self, data):
+        """Process the received bytes and return the answers (bytes)"""
+        self._buffer += data
+        *lines, self._buffer = self._buffer.split(b'\r')
+        replies = []
+        for line in lines:
+            reply = self.handle_line(line.decode().strip())
+            if reply is not None:
+                replies.append(reply.encode())
+        return b''.join(replies)
+
+    def handle_line(self, line):
+        """
+        Handle one line, returning the answer (with its line terminators)
+        or None for commands
+        """
+        if not line:
+            return
+        ack = line.startswith('#')
+        if ack:
+            line = line[1:]
+        self.update()
+        words = line.upper().split()
+        name, args = words[0], words[1:]
+        if name == '?ERR':
+            return '{}\r\n'.format(self.error)
+        try:
+            if name.startswith('?'):
+                answer = self.query(name[1:], args)
+            else:
+                answer = None
+                self.command(name, args)
+        except SimError as error:
+            self.error = str(error)
+            if ack or name.startswith('?'):
+                return 'ERROR\r\n'
+            return
+        self.error = ERR_OK
+        if isinstance(answer, (list, tuple)):
+            lines = ['$'] + list(answer) + ['$']
+            return ''.join('{}\r\n'.format(line) for line in lines)
+        if answer is not None:
+            return '{}\r\n'.format(answer)
+        if ack:
+            return 'OK\r\n'
+
+    def query(self, name, args):
+        if name in self.settings:
+            return self.settings[name]
+        if name in self.values:
+            return _format(self.values[name])
+        if name == 'BEAM':
+            return ' '.join(map(_format, self.beam()))
+        if name == 'FBEAM':
+            return ' '.join(map(_format, self.fbeam()))
+        if name == 'OSCBEAM':
+            return ' '.join(map(_format, self.osc_beam()))
+        if name == 'STATE':
+            if self.settings['PAUSE'] == 'ON':
+                return 'PAUSED {}'.format(self.state)
+            return self.state
+        if name == 'PIEZO':
+            return _format(self.piezo)
+        if name == 'SPEED':
+            return ' '.join(map(_format, self.speed))
+        if name == 'SET':
+            return ' '.join(self.flags)
+        if name == 'CLEAR':
+            return ' '.join(f for f in FLAGS if f not in self.flags)
+        if name == 'VER':
+            return VERSION
+        if name == 'CHAIN':
+            return 'NO RS232'
+        if name == 'OSCSAT':
+            return '0'
+        if name == 'HELP':
+            return ['  ' + cmd for cmd in HELP]
+        if name == 'INFO':
+            lines = [' {}  -  Current settings:'.format(VERSION)]
+            for setting in INFO_SETTINGS:
+                lines.append('  {} {}'.format(setting,
+                                              self.query(setting, ())))
+            return lines
+        raise SimError(ERR_UNKNOWN)
+
+    def command(self, name, args):
+        if name in ('ECHO', 'NOECHO'):
+            return
+        if name == 'RESET':
+            return self.reset()
+        if name in self.values:
+            self.values[name] = self._float(args, 1)[0]
+        elif name in self.settings:
+            self._setting(name, args)
+        elif name == 'SPEED':
+            speed = self._float(args, 1, 2)
+            self.speed[:len(speed)] = speed
+        elif name == 'PIEZO':
+            piezo, = self._float(args, 1)
+            self._start([('MOVE', piezo, self.speed[1])])
+        elif name in ('SET', 'CLEAR'):
+            self._flags(name, args)
+        elif name == 'STOP':
+            self._program, self._target = [], None
+            self.state = 'IDLE'
+        elif name == 'GO':
+            self._setpoint(args)
+            self._start([('SEARCH', self._operation_point,
+                          self.speed[0])])
+        elif name == 'TUNE':
+            self._tune(args)
+        else:
+            raise SimError(ERR_UNKNOWN)
+
+    def _float(self, args, nb_min, nb_max=None):
+        if not nb_min <= len(args) <= (nb_max or nb_min):
+            raise SimError(ERR_NB_PARAMS)
+        try:
+            return [float(arg) for arg in args]
+        except ValueError:
+            raise SimError(ERR_PARAM)
+
+    def _setting(self, name, args):
+        if name == 'OSCIL':
+            if args not in (['ON'], ['OFF']):
+                raise SimError(ERR_PARAM)
+        elif name == 'PAUSE':
+            args = args or ['ON']
+            if args not in (['ON'], ['OFF']):
+                raise SimError(ERR_PARAM)
+        elif name == 'MODE':
+            if args not in (['INTENSITY'], ['POSITION'], ['OSCILLATION']):
+                raise SimError(ERR_PARAM)
+        elif name == 'INBEAM' and args == ['SOFT']:
+            args = ['SOFT', '1']
+        elif not args:
+            raise SimError(ERR_NB_PARAMS)
+        self.settings[name] = ' '.join(args)
+
+    def _flags(self, name, args):
+        if not args:
+            raise SimError(ERR_NB_PARAMS)
+        for flag in args:
+            if flag not in FLAGS + SIDES:
+                raise SimError(ERR_PARAM)
+        for flag in args:
+            if name == 'CLEAR':
+                if flag in self.flags:
+                    self.flags.remove(flag)
+            elif flag in SIDES:
+                self.flags = [f for f in self.flags if f not in SIDES]
+                self.flags.insert(0, flag)
+            elif flag not in self.flags:
+                self.flags.append(flag)
+
+    def _setpoint(self, args):
+        if not args:
+            return
+        if args == ['#']:
+            now = self.clock()
+            self.values['SETPOINT'] = self._curve(self.piezo, now)
+        else:
+            self.values['SETPOINT'] = self._float(args, 1)[0]
+
+    def _tune(self, args):
+        peak = args == ['PEAK']
+        if not peak:
+            self._setpoint(args)
+        low, high = self._scan_range()
+        scan_speed, move_speed = self.speed
+        program = [('MOVE', low, move_speed), ('SCAN', high, scan_speed)]
+        if peak:
+            program.append(('MOVE', self._center, move_speed))
+        else:
+            program.append(('SEARCH', self._operation_point, move_speed))
+        self._start(program)
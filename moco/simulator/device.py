@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the MoCo project
+#
+# Copyright (c) 2020 ALBA controls team
+# Distributed under the GNU General Public License v3.
+# See LICENSE for more info.
+
+"""
+sinstruments device for the MoCo simulator (see moco.simulator).
+
+Options: ``latency`` (seconds per request), ``byte_time`` (seconds per
+answer byte) and ``model`` (dict of MocoSim parameters).
+"""
+
+import gevent
+from sinstruments.simulator import BaseDevice
+
+from . import MocoSim
+
+
+class Moco(BaseDevice):
+
+    newline = b'\r'
+
+    def __init__(self, name, latency=0.0, byte_time=0.0, model=None,
+                 **opts):
+        super().__init__(name, **opts)
+        self.latency = float(latency)
+        self.byte_time = float(byte_time)
+        self.sim = MocoSim(**(model or {}))
+
+    def handle_message(self, line):
+        ans = self.sim.handle_line(line.decode().strip())
+        if ans is None:
+            return
+        ans = ans.encode()
+        gevent.sleep(self.latency + len(ans) * self.byte_time)
+        return ans
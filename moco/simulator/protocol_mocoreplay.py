@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the MoCo project
+#
+# Copyright (c) 2020 ALBA controls team
+# Distributed under the GNU General Public License v3.
+# See LICENSE for more info.
+
+"""
+pyserial handler replaying a moco.recording.Recorder file:
+
+    mocoreplay://<recording file>[?scale=<factor>]
+
+Each request written is answered with the recorded answers of the same
+request in turn (cycling), after the recorded duration multiplied by
+scale (default 1, 0: immediately). Unknown requests get no answer.
+"""
+
+import urllib.parse
+
+from serial.serialutil import SerialException, PortNotOpenError
+
+from ..recording import Recording, _flatten
+from . import protocol_mocosim
+
+
+class Serial(protocol_mocosim.Serial):
+
+    def open(self):
+        if self.is_open:
+            raise SerialException('Port is already open.')
+        if self._port is None:
+            raise SerialException(
+                'Port must be configured before it can be used.')
+        filename, scale = self.from_url(self.port)
+        self.recording = Recording(filename, scale)
+        self.is_open = True
+
+    def from_url(self, url):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme != 'mocoreplay':
+            raise SerialException(
+                'expected a string in the form "mocoreplay://<file>'
+                '[?scale=<factor>]": not starting with mocoreplay:// '
+                '({!r})'.format(parts.scheme))
+        scale = 1.0
+        for option, values in urllib.parse.parse_qs(parts.query).items():
+            if option == 'scale':
+                scale = float(values[0])
+            else:
+                raise SerialException('unknown option {!r}'.format(option))
+        return parts.netloc + parts.path, scale
+
+    def write(self, data):
+        if not self.is_open:
+            raise PortNotOpenError()
+        data = bytes(data)
+        transaction = self.recording.find(data)
+        if transaction is not None:
+            ans = _flatten(transaction.answer)
+            if ans:
+                self._queue_answer(ans, self.recording.delay(transaction))
+        return len(data)
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the MoCo project
+#
+# Copyright (c) 2020 ALBA controls team
+# Distributed under the GNU General Public License v3.
+# See LICENSE for more info.
+
+"""
+pyserial handler for the in-process simulator URL:
+
+    mocosim://[?latency=<s>][&byte_time=<s>][&<MocoSim parameter>=<value>]
+
+The answers are made available after ``latency`` seconds plus
+``byte_time`` seconds per transmitted byte, both ways.
+"""
+
+import time
+import collections
+import urllib.parse
+
+from serial.serialutil import SerialBase, SerialException, PortNotOpenError
+
+from . import MocoSim
+
+
+class Serial(SerialBase):
+
+    def __init__(self, *args, **kwargs):
+        self.sim = None
+        self.latency = 0.0
+        self.byte_time = 0.0
+        self._rx = collections.deque()
+        super().__init__(*args, **kwargs)
+
+    def open(self):
+        if self.is_open:
+            raise SerialException('Port is already open.')
+        if self._port is None:
+            raise SerialException(
+                'Port must be configured before it can be used.')
+        self.sim = MocoSim(**self.from_url(self.port))
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+        super().close()
+
+    def from_url(self, url):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme != 'mocosim':
+            raise SerialException(
+                'expected a string in the form "mocosim://[?option=value]":'
+                ' not starting with mocosim:// ({!r})'.format(parts.scheme))
+        options = {}
+        for option, values in urllib.parse.parse_qs(parts.query).items():
+            if option in ('latency', 'byte_time'):
+                setattr(self, option, float(values[0]))
+            else:
+                options[option] = values[0]
+        return options
+
+    def _reconfigure_port(self):
+        pass
+
+    @property
+    def in_waiting(self):
+        if not self.is_open:
+            raise PortNotOpenError()
+        now = time.monotonic()
+        return sum(1 for ready, _ in self._rx if ready <= now)
+
+    def write(self, data):
+        if not self.is_open:
+            raise PortNotOpenError()
+        data = bytes(data)
+        ans = self.sim.feed(data)
+        if ans:
+            self._queue_answer(ans, len(data) * self.byte_time + self.latency)
+        return len(data)
+
+    def _queue_answer(self, ans, delay):
+        """Make ans readable after delay seconds (plus byte_time per byte)"""
+        start = time.monotonic() + delay
+        if self._rx:
+            start = max(start, self._rx[-1][0])
+        for i, byte in enumerate(ans, 1):
+            self._rx.append((start + i * self.byte_time, bytes((byte,))))
+
+    def read(self, size=1):
+        if not self.is_open:
+            raise PortNotOpenError()
+        timeout = self._timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        data = bytearray()
+        while len(data) < size:
+            now = time.monotonic()
+            if not self._rx:
+                # nothing else will come: emulate the read timeout
+                if deadline is not None and deadline > now:
+                    time.sleep(deadline - now)
+                break
+            ready, byte = self._rx[0]
+            if ready > now:
+                if deadline is not None and ready > deadline:
+                    time.sleep(max(deadline - now, 0))
+                    break
+                time.sleep(ready - now)
+            self._rx.popleft()
+            data += byte
+        return bytes(data)
+
+    def reset_input_buffer(self):
+        self._rx.clear()
+
+    def reset_output_buffer(self):
+        pass
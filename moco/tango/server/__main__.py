@@ -6,6 +6,31 @@
 # Distributed under the GNU General Public License v3.
 # See LICENSE for more info.
 
+# launcher option enabling polling_pool_per_device()
+POLLING_POOL_OPTION = '--polling-pool-per-device'
+
+
+def polling_pool_per_device():
+    """
+    One Tango polling thread per Moco device of the server (unless more
+    are configured) so that a slow controller doesn't delay the polling
+    of the others.
+
+    Opt-in (POLLING_POOL_OPTION): it queries the Tango DB before the server
+    starts. Setting the polling_threads_pool_conf property of the admin
+    device (dserver/Moco/<instance>) does the same at no startup cost.
+    """
+    import tango
+    util = tango.Util.instance()
+    try:
+        devices = tango.Database().get_device_name(util.get_ds_name(),
+                                                   'Moco')
+    except tango.DevFailed:
+        # no database
+        return
+    util.set_polling_threads_pool_size(
+        max(util.get_polling_threads_pool_size(), len(devices)))
+
 
 def main():
     import sys
@@ -13,9 +38,14 @@ def main():
     import tango.server
     from .moco import Moco
     args = ['Moco'] + sys.argv[1:]
+    pre_init_callback = None
+    if POLLING_POOL_OPTION in args:
+        args.remove(POLLING_POOL_OPTION)
+        pre_init_callback = polling_pool_per_device
     fmt = '%(asctime)s %(threadName)s %(levelname)s %(name)s %(message)s'
     logging.basicConfig(level=logging.INFO, format=fmt)
-    tango.server.run((Moco,), args=args)
+    tango.server.run((Moco,), args=args,
+                     pre_init_callback=pre_init_callback)
 
 
 main()
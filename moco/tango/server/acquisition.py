@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the MoCo project
+#
+# Copyright (c) 2020 ALBA controls team
+# Distributed under the GNU General Public License v3.
+# See LICENSE for more info.
+
+import time
+import logging
+import threading
+
+import numpy
+
+
+class RingBuffer:
+    """Fixed size history of rows of floats"""
+
+    def __init__(self, size, width):
+        self._data = numpy.full((size, width), numpy.nan)
+        self._index = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def append(self, row):
+        with self._lock:
+            self._data[self._index] = row
+            self._index = (self._index + 1) % len(self._data)
+            self._count = min(self._count + 1, len(self._data))
+
+    def clear(self):
+        with self._lock:
+            self._index = self._count = 0
+
+    def read(self):
+        """Return a copy of the rows, oldest first"""
+        with self._lock:
+            if self._count < len(self._data):
+                return self._data[:self._count].copy()
+            return numpy.roll(self._data, -self._index, axis=0)
+
+
+class Acquisition:
+    """
+    Background loop sampling ?BEAM, ?FBEAM and ?PIEZO (in a single burst)
+    into a RingBuffer. period=0 samples as fast as the link allows.
+    on_update is called at most every update_period seconds.
+    """
+
+    QUERIES = ['BEAM', 'FBEAM', 'PIEZO']
+    COLUMNS = ['time', 'beam_in', 'beam_out', 'fbeam_in', 'fbeam_out',
+               'piezo']
+
+    def __init__(self, moco, size, period=0.0, on_update=None,
+                 update_period=1.0):
+        self.log = logging.getLogger('{}.Acquisition'.format(__name__))
+        self.moco = moco
+        self.buffer = RingBuffer(size, len(self.COLUMNS))
+        self.period = period
+        self.on_update = on_update
+        self.update_period = update_period
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return (self._thread is not None and self._thread.is_alive() and
+                not self._stop.is_set())
+
+    def start(self):
+        if self.running:
+            return
+        # a stopped loop may still be finishing: it keeps its own event
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(self._stop,),
+                                        name='MocoAcquisition', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stop the loop, waiting at most timeout seconds for it to end (the
+        loop never calls on_update once stopped)
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def history(self):
+        return self.buffer.read()
+
+    def _run(self, stop):
+        last_update = 0
+        while not stop.is_set():
+            start = time.time()
+            try:
+                beam, fbeam, piezo = self.moco.read_cmds(self.QUERIES)
+                row = [start]
+                row.extend(float(value) for value in beam.split())
+                row.extend(float(value) for value in fbeam.split())
+                row.append(float(piezo))
+                self.buffer.append(row)
+            except Exception:
+                if stop.is_set():
+                    break
+                self.log.exception('Error sampling signals')
+                # do not flood a failing controller
+                stop.wait(1)
+                continue
+            now = time.time()
+            if stop.is_set():
+                break
+            if self.on_update and now - last_update >= self.update_period:
+                last_update = now
+                try:
+                    self.on_update()
+                except Exception:
+                    self.log.exception('Error in acquisition update')
+            stop.wait(self.period - (now - start))
@@ -6,46 +6,381 @@
 # Distributed under the GNU General Public License v3.
 # See LICENSE for more info.
 
+import json
+import time
 
 from tango.server import Device, attribute, device_property, command
 from tango import AttributeProxy, DevState
 import moco.core
-
-
-class Moco(Device):
+import moco.recording
+from moco.commands import PARAMS
+from .acquisition import Acquisition
+from .operation import OperationMonitor
+from .poller import Poller
+
+MAX_HISTORY_SIZE = 100000
+
+# requests of the ReadSignals command
+SIGNAL_CMDS = ['BEAM', 'FBEAM', 'OSCBEAM', 'PIEZO']
+
+# default criteria of the events pushed by the internal poller (see
+# eventPollingPeriod). They can be changed per attribute through the usual
+# abs_change/rel_change/archive_* attribute properties.
+SETTING_EVENTS = dict(abs_change=1e-9, archive_abs_change=1e-9)
+SIGNAL_EVENTS = dict(rel_change=1, archive_rel_change=5)
+PIEZO_EVENTS = dict(abs_change=1e-3, archive_abs_change=1e-2)
+
+# attributes of the long-running operations (Tune, TunePeak, Go), pushed
+# as change events by the OperationMonitor
+OPERATION_ATTRS = ['Operation', 'OperationRunning', 'OperationProgress']
+
+# time (s) delete_device waits for the background loops to end
+STOP_TIMEOUT = 0.5
+
+# signal history attributes and their Acquisition.COLUMNS index
+HISTORY_ATTRS = {
+    'HistoryTime': 0,
+    'HistoryBeamIn': 1,
+    'HistoryBeamOut': 2,
+    'HistoryFBeamIn': 3,
+    'HistoryFBeamOut': 4,
+    'HistoryPiezo': 5,
+}
+
+
+def _word(index, decode=float):
+    return lambda ans: decode(ans.split()[index])
+
+
+def _floats(ans):
+    return [float(value) for value in ans.split()]
+
+
+# ?STATE answer (without PAUSED prefix) to Tango state
+STATES = {
+    'IDLE': DevState.ON,
+    'MOVE': DevState.MOVING,
+    'SCAN': DevState.MOVING,
+    'SEARCH': DevState.MOVING,
+    'RUN': DevState.RUNNING,
+    'WAITBEAM': DevState.ALARM,
+    'WAIT': DevState.ALARM,
+    'OVERLOAD': DevState.ALARM,
+    'ALARM': DevState.FAULT,
+}
+
+# attributes the event poller can refresh: controller query and decoder
+EVENT_ATTRS = {param.attr: (param.cmd, param.decode)
+               for param in PARAMS if param.attr is not None}
+EVENT_ATTRS.update({
+    'Beam': ('BEAM', str),
+    'Beam_In': ('BEAM', _word(0)),
+    'Beam_Out': ('BEAM', _word(1)),
+    'FBeam': ('FBEAM', str),
+    'FBeam_In': ('FBEAM', _word(0)),
+    'FBeam_Out': ('FBEAM', _word(1)),
+    'Speed': ('SPEED', _floats),
+    'ScanSpeed': ('SPEED', _word(0)),
+    'MoveSpeed': ('SPEED', _word(1)),
+    'OscBeamMainSignal': ('OSCBEAM', _word(0)),
+    'OscBeamQuadSignal': ('OSCBEAM', _word(1)),
+})
+
+# event criteria of the generated attributes (default: SETTING_EVENTS)
+PARAM_EVENTS = {'Piezo': PIEZO_EVENTS}
+
+
+def _param_attribute(param):
+    """Tango attribute of a moco.commands.Param"""
+    name = param.name
+
+    def read(self):
+        return getattr(self.moco, name)()
+
+    kwargs = {}
+    if param.arity is None:
+        kwargs.update(dtype=[param.dtype], max_dim_x=8)
+    else:
+        kwargs.update(dtype=param.dtype)
+    if param.dtype is float:
+        kwargs.update(PARAM_EVENTS.get(param.attr, SETTING_EVENTS))
+    if param.attr_read_only:
+        kwargs['description'] = 'Query {} (equivalent to ?{})'.format(
+            param.doc, param.cmd)
+    else:
+        def write(self, value):
+            getattr(self.moco, name)(value)
+
+        kwargs['fset'] = write
+        kwargs['description'] = 'Set/query {} (equivalent to ?{}/{})'.format(
+            param.doc, param.cmd, param.cmd)
+    return attribute(fget=read, **kwargs)
+
+
+# the attributes of a Tango device class are collected when the class is
+# created: the generated ones are declared in the namespace of a base class
+_ParamAttributes = type('_ParamAttributes', (Device,), {
+    param.attr: _param_attribute(param)
+    for param in PARAMS if param.attr is not None})
+
+
+class Moco(_ParamAttributes):
 
     url = device_property(dtype=str)
     softwareInBeamAtt = device_property(dtype=str, default_value=None)
+    historySize = device_property(
+        dtype=int, default_value=10000,
+        doc='Number of samples kept by the signal acquisition (max. {})'
+            .format(MAX_HISTORY_SIZE))
+    acquisitionPeriod = device_property(
+        dtype=float, default_value=0.0,
+        doc='Signal sampling period (s). 0 samples as fast as possible')
+    acquisitionEventPeriod = device_property(
+        dtype=float, default_value=1.0,
+        doc='Period (s) of the History* change/archive events')
+    autoStartAcquisition = device_property(dtype=bool, default_value=False)
+    eventPollingPeriod = device_property(
+        dtype=float, default_value=1.0,
+        doc='Period (s) of the internal poller refreshing the device State '
+            'and pushing change/archive events of eventAttributes. 0 '
+            'disables it. The event criteria (abs_change, rel_change, '
+            'archive_*) are the attribute ones')
+    parameterCacheTTL = device_property(
+        dtype=float, default_value=0.0,
+        doc='Time (s) the rarely changing settings (InBeamConf, Mode, Tau, '
+            'Phase, OperationFlags...) are served from a cache updated by '
+            'the writes. 0 disables the cache')
+    reconnectMaxDelay = device_property(
+        dtype=float, default_value=30.0,
+        doc='Maximum delay (s) between reconnection attempts when the link '
+            'to the controller is down')
+    operationPollingPeriod = device_property(
+        dtype=float, default_value=0.2,
+        doc='Period (s) of the ?STATE reads tracking the Tune, TunePeak '
+            'and Go operations until the controller is no longer busy')
+    trafficLog = device_property(
+        dtype=str, default_value='',
+        doc='File the controller traffic is appended to (see '
+            'moco.recording), e.g. to replay it later with a '
+            'mocoreplay://<file> url. Empty disables the recording')
+    eventAttributes = device_property(
+        dtype=[str], default_value=['MocoState'],
+        doc='Attributes refreshed by the internal poller (any of {})'.format(
+            ', '.join(EVENT_ATTRS)))
 
     def init_device(self):
         super().init_device()
-        self.moco = moco.core.Moco.for_url(self.url)
+        # reopened on link failures, see ConnectionHealth
+        self.io_stats = moco.core.IOStats()
+        self.recorder = None
+        if self.trafficLog:
+            self.recorder = moco.recording.Recorder(self.trafficLog)
+        self.link = moco.core.ManagedConn(self.url,
+                                          retry_max=self.reconnectMaxDelay,
+                                          stats=self.io_stats,
+                                          recorder=self.recorder)
+        # attributes may be read concurrently by clients and polling
+        cache = None
+        if self.parameterCacheTTL > 0:
+            cache = moco.core.ParamCache(
+                {name: self.parameterCacheTTL
+                 for name in moco.core.ParamCache.TTLS})
+        # one I/O worker per device: a slow controller never stalls the others
+        conn = moco.core.QueuedConn(self.link,
+                                    name='MocoIO {}'.format(self.get_name()))
+        self.moco = moco.core.Moco(conn, cache)
+        # nothing here waits for the controller or the Tango DB: the link
+        # is opened by its background thread (the devices of a server
+        # connect in parallel, requests fail at once meanwhile) and the
+        # softwareInBeamAtt proxy is created on first use
+        self.set_state(DevState.INIT)
+        self.set_status('Connecting to {}'.format(self.url))
+        # last state and status mapped from ?STATE (see dev_state)
+        self._mapped_state = DevState.ON, 'Connected to {}'.format(self.url)
+        self.link.connect(wait=False)
         self.in_beam_attr_proxy = None
-        if self.softwareInBeamAtt is not None:
-            self.in_beam_attr_proxy = AttributeProxy(self.softwareInBeamAtt)
-        self.set_state(DevState.ON)
+        self._snapshot = {}
+        self.acquisition = Acquisition(
+            self.moco, min(self.historySize, MAX_HISTORY_SIZE),
+            period=self.acquisitionPeriod, on_update=self._push_history,
+            update_period=self.acquisitionEventPeriod)
+        for name in HISTORY_ATTRS:
+            self.set_change_event(name, True, False)
+            self.set_archive_event(name, True, False)
+        if self.autoStartAcquisition:
+            self.acquisition.start()
+        # the state is always refreshed by the poller
+        event_attrs = {'MocoState': EVENT_ATTRS['MocoState']}
+        for name in self.eventAttributes:
+            name = self._attr_name(name)
+            event_attrs[name] = EVENT_ATTRS[name]
+            self.set_change_event(name, True, True)
+            self.set_archive_event(name, True, True)
+        self.poller = Poller(self.moco, event_attrs,
+                             self.eventPollingPeriod, self._push_events)
+        self.operation = OperationMonitor(self.moco,
+                                          self.operationPollingPeriod,
+                                          self._operation_update)
+        self._operation_pushed = None
+        for name in ['State'] + OPERATION_ATTRS:
+            self.set_change_event(name, True, False)
+        if self.eventPollingPeriod > 0:
+            self.poller.start()
+
+    def delete_device(self):
+        # the loops push events, which needs the device monitor held by
+        # this thread: stop them all and give them a short time to end
+        # (a loop blocked in a push ends on its own after Init)
+        loops = [self.operation, self.poller, self.acquisition]
+        for loop in loops:
+            loop.stop(timeout=0)
+        deadline = time.monotonic() + STOP_TIMEOUT
+        for loop in loops:
+            loop.stop(timeout=max(deadline - time.monotonic(), 0))
+        self.moco.conn.close()
+        if self.recorder is not None:
+            self.recorder.close()
+        super().delete_device()
+
+    @staticmethod
+    def _attr_name(name):
+        # device properties are not case sensitive, attributes neither
+        for attr_name in EVENT_ATTRS:
+            if attr_name.lower() == name.lower():
+                return attr_name
+        raise ValueError('{!r} cannot be polled for events'.format(name))
+
+    def dev_state(self):
+        # refreshed by the poller: never read the controller here. Without
+        # it, the state read last (e.g. at the end of an operation) is kept
+        # and only the link state is refreshed
+        if (not self.poller.running and not self.operation.running and
+                not self._update_link_state()):
+            state, status = self._mapped_state
+            self.set_state(state)
+            self.set_status(status)
+        return self.get_state()
+
+    def dev_status(self):
+        self.dev_state()
+        return self.get_status()
+
+    def _update_link_state(self):
+        """
+        Set the state if the link is not usable (INIT while connecting,
+        FAULT if it never connected, UNKNOWN if the connection was lost).
+        Return True if it was set.
+        """
+        if self.link.health == self.link.CONNECTED:
+            return False
+        elif not self.link.connected_once and self.link.error is None:
+            self.set_state(DevState.INIT)
+            self.set_status('Connecting to {}'.format(self.url))
+        elif self.link.connected_once:
+            self.set_state(DevState.UNKNOWN)
+            self.set_status('No connection to the controller: {}'.format(
+                self.link.error))
+        else:
+            self.set_state(DevState.FAULT)
+            self.set_status('Cannot connect to the controller: {}'.format(
+                self.link.error))
+        return True
+
+    def _update_state(self, values):
+        if self._update_link_state():
+            return
+        if isinstance(values, Exception):
+            state = DevState.FAULT
+            status = 'Cannot read the controller state: {}'.format(values)
+        else:
+            moco_state = values['MocoState']
+            words = moco_state.split()
+            state = STATES.get(words[-1] if words else '', DevState.UNKNOWN)
+            status = 'Controller state: {}'.format(moco_state)
+        self._mapped_state = state, status
+        self.set_state(state)
+        self.set_status(status)
+
+    def _push_events(self, values):
+        self._update_state(values)
+        if isinstance(values, Exception):
+            return
+        for name, value in values.items():
+            self.push_change_event(name, value)
+            self.push_archive_event(name, value)
+
+    def _start_operation(self, name, func):
+        """
+        Send the operation command and track it in the background: the
+        command returns as soon as the controller accepted it
+        """
+        func()
+        self.operation.start(name)
+
+    def _operation_update(self, state):
+        if state is None:
+            self.set_state(DevState.MOVING)
+            self.set_status('{} started'.format(self.operation.name))
+        elif isinstance(state, Exception):
+            self._update_state(state)
+        else:
+            self._update_state({'MocoState': state})
+        pushed = (self.get_state(), self.operation.name,
+                  self.operation.running, self.operation.progress)
+        # start events are always pushed (e.g. TUNE again)
+        if state is not None and pushed == self._operation_pushed:
+            return
+        self._operation_pushed = pushed
+        self.push_change_event('State')
+        self.push_change_event('Operation', self.operation.name)
+        self.push_change_event('OperationRunning', self.operation.running)
+        self.push_change_event('OperationProgress', self.operation.progress)
+
+    def _push_history(self):
+        history = self.acquisition.history()
+        for name, column in HISTORY_ATTRS.items():
+            self.push_change_event(name, history[:, column])
+            self.push_archive_event(name, history[:, column])
+
+    def _read_history(self, name):
+        history = self._read_snapshot(self.acquisition.history)
+        return history[:, HISTORY_ATTRS[name]]
+
+    def read_attr_hardware(self, attr_list):
+        # New read cycle: attributes sharing a controller query (e.g.
+        # Beam_In/Beam_Out) get it from a single serial transaction
+        self._snapshot = {}
+
+    def _read_snapshot(self, func):
+        key = func.__name__
+        if key not in self._snapshot:
+            self._snapshot[key] = func()
+        return self._snapshot[key]
+
     # ------------------------------------------------------------------
     # COMMANDS
     # ------------------------------------------------------------------
     @command()
     def RestoreSoftInBeam(self):
-        if self.in_beam_attr_proxy is None:
+        if self.softwareInBeamAtt is None:
             raise Exception("Error: softwareInBeamAttr is not defined")
+        if self.in_beam_attr_proxy is None:
+            self.in_beam_attr_proxy = AttributeProxy(self.softwareInBeamAtt)
         value = self.in_beam_attr_proxy.read().value
         self.moco.soft_beam(value)
 
+    # the operations are followed with the Operation* attributes
     @command()
     def Tune(self):
-        self.moco.tune()
+        self._start_operation('TUNE', self.moco.tune)
 
     @command()
     def TunePeak(self):
-        self.moco.tune_peak()
-        self.setToMoco("TUNE PEAK")
+        self._start_operation('TUNE PEAK', self.moco.tune_peak)
 
     @command()
     def Go(self):
-        self.moco.go()
+        self._start_operation('GO', self.moco.go)
 
     @command()
     def Stop(self):
@@ -88,9 +423,61 @@ class Moco(Device):
                 ans = [ans]
         else:
             self.moco.write_cmd(arg)
+            # a raw command may change any cached setting
+            if self.moco.cache is not None:
+                self.moco.cache.clear()
             ans = []
         return ans
 
+    @command(dtype_out=str,
+             doc_out='JSON object with the time of the readout and the '
+                     'values of all the parameters by controller command '
+                     '(e.g. {"time": 1600000000.0, "values": {"TAU": 1.0, '
+                     '...}}), read in a single serial burst')
+    def Snapshot(self):
+        return json.dumps(self.moco.snapshot())
+
+    @command(dtype_out=[float],
+             doc_out='Read time (s since epoch), Beam_In, Beam_Out, '
+                     'FBeam_In, FBeam_Out, OscBeamMainSignal, '
+                     'OscBeamQuadSignal and Piezo, read in a single serial '
+                     'burst')
+    def ReadSignals(self):
+        timestamp = time.time()
+        values = self.moco.read_many(SIGNAL_CMDS)
+        signals = [timestamp]
+        signals.extend(values['BEAM'])
+        signals.extend(values['FBEAM'])
+        signals.extend(values['OSCBEAM'])
+        signals.append(values['PIEZO'])
+        return signals
+
+    @command(dtype_out=str,
+             doc_out='JSON object of the controller settings by command '
+                     '(e.g. {"MODE": "INTENSITY", "TAU": 1.0, ...})')
+    def GetConfig(self):
+        return json.dumps(self.moco.config())
+
+    @command(dtype_in=str, dtype_out=[str],
+             doc_in='JSON object of settings as returned by GetConfig',
+             doc_out='Commands sent: only the settings which differ from '
+                     'the current ones are written')
+    def ApplyConfig(self, config):
+        return self.moco.apply_config(json.loads(config))
+
+    @command()
+    def ResetIOStatistics(self):
+        self.io_stats.reset()
+
+    @command()
+    def StartAcquisition(self):
+        self.acquisition.start()
+
+    @command()
+    def StopAcquisition(self):
+        # do not wait for a pending History push (it needs the monitor)
+        self.acquisition.stop(timeout=STOP_TIMEOUT)
+
     @command()
     def OscilOn(self):
         self.moco.oscil('ON')
@@ -102,122 +489,45 @@ class Moco(Device):
     # ------------------------------------------------------------------
     # ATTRIBUTES
     # ------------------------------------------------------------------
-    @attribute(dtype=str,
-               description='Set/query INBEAM configuration equivalent to '
-                           '(?INBEAM/INBEAM)')
-    def InBeamConf(self):
-        return self.moco.in_beam_conf()
-
-    @InBeamConf.write
-    def InBeamConf(self, value):
-        self.moco.in_beam_conf(value)
-
-    @attribute(dtype=str,
-               description='Set/query OUTBEAM configuration (equivalent to '
-                           '?OUTBEAM/OUTBEAM)')
-    def OutBeamConf(self):
-        return self.moco.out_beam_conf()
-
-    @OutBeamConf.write
-    def OutBeamConf(self, value):
-        self.moco.out_beam_conf(value)
-
-    @attribute(dtype=float,
-               description='Set/query setpoint value (equivalent to '
-                           '?SETPOINT/SETPOINT)')
-    def SetPoint(self):
-        return self.moco.set_point()
-
-    @SetPoint.write
-    def SetPoint(self, value):
-        self.moco.set_point(value)
-
-    @attribute(dtype=str,
-               description='Set/query operation mode (equivalent to '
-                           '?MODE/MODE)')
-    def Mode(self):
-        return self.moco.mode()
-
-    @Mode.write
-    def Mode(self, value):
-        self.moco.mode(value)
-
-    @attribute(dtype=float,
-               description='Set/query regulation time constant (equivalent '
-                           'to ?TAU/TAU)')
-    def Tau(self):
-        return self.moco.tau()
-
-    @Tau.write
-    def Tau(self, value):
-        self.moco.tau(value)
-
-    @attribute(dtype=float,
-               description='Set/query software INBEAM values (equivalent to '
-                           '?SOFTBEAM/SOFTBEAM)')
-    def SoftBeam(self):
-        return self.moco.soft_beam()
-
-    @SoftBeam.write
-    def SoftBeam(self, value):
-        self.moco.soft_beam(value)
-
-    @attribute(dtype=[str], max_dim_x=8,
-               description='Set/query operation flags  equivalent to '
-                           '?SET/SET)')
-    def OperationFlags(self):
-        return self.moco.operation_flags()
+    # InBeamConf, Tau, Piezo, MocoState... are generated from
+    # moco.commands.PARAMS (see _ParamAttributes)
 
     @attribute(dtype=str)
     def Beam(self):
-        beam, _, _ = self.moco.beam()
+        beam, _, _ = self._read_snapshot(self.moco.beam)
         return beam
 
-    @attribute(dtype=float)
+    @attribute(dtype=float, **SIGNAL_EVENTS)
     def Beam_In(self):
-        _, beam_in, _ = self.moco.beam()
+        _, beam_in, _ = self._read_snapshot(self.moco.beam)
         return beam_in
 
-    @attribute(dtype=float)
+    @attribute(dtype=float, **SIGNAL_EVENTS)
     def Beam_Out(self):
-        _, _, beam_out = self.moco.beam()
+        _, _, beam_out = self._read_snapshot(self.moco.beam)
         return beam_out
 
     @attribute(dtype=str)
     def FBeam(self):
-        fbeam, _, _ = self.moco.fbeam()
+        fbeam, _, _ = self._read_snapshot(self.moco.fbeam)
         return fbeam
 
-    @attribute(dtype=float)
+    @attribute(dtype=float, **SIGNAL_EVENTS)
     def FBeam_In(self):
-        _, fbeam_in, _ = self.moco.fbeam()
+        _, fbeam_in, _ = self._read_snapshot(self.moco.fbeam)
         return fbeam_in
 
-    @attribute(dtype=float)
+    @attribute(dtype=float, **SIGNAL_EVENTS)
     def FBeam_Out(self):
-        _, _, fbeam_out = self.moco.fbeam()
+        _, _, fbeam_out = self._read_snapshot(self.moco.fbeam)
         return fbeam_out
 
-    @attribute(dtype=str,
-               description='Query controller state (equivalent to ?STATE)')
-    def MocoState(self):
-        return self.moco.state()
-
-    @attribute(dtype=float,
-               description='Set/query output voltage (equivalent to '
-                           '?PIEZO/PIEZO)')
-    def Piezo(self):
-        return self.moco.piezo()
-
-    @Piezo.write
-    def Piezo(self, value):
-        self.moco.piezo(value)
-
     @attribute(dtype=[float], max_dim_x=2,
                description='Set/query scanning speed values (equivalent to '
-                           '?SPEED/SPEED)')
+                           '?SPEED/SPEED)',
+               **SETTING_EVENTS)
     def Speed(self):
-        return self.moco.speed()
+        return self._read_snapshot(self.moco.speed)
 
     @Speed.write
     def Speed(self, value):
@@ -225,8 +535,10 @@ class Moco(Device):
 
     @attribute(dtype=float,
                description='Set/query scanning speed values (equivalent to '
-                           '?SPEED/SPEED)')
+                           '?SPEED/SPEED)',
+               **SETTING_EVENTS)
     def ScanSpeed(self):
+        # last speeds read or written, no request once known
         return self.moco.scan_speed()
 
     @ScanSpeed.write
@@ -235,7 +547,8 @@ class Moco(Device):
 
     @attribute(dtype=float,
                description='Set/query scanning speed values (equivalent to '
-                           '?SPEED/SPEED)')
+                           '?SPEED/SPEED)',
+               **SETTING_EVENTS)
     def MoveSpeed(self):
         return self.moco.move_speed()
 
@@ -245,58 +558,160 @@ class Moco(Device):
 
     @attribute(dtype=float,
                description='Query main signal amplitude (equivalent to '
-                           '?OSCBEAM[0])')
+                           '?OSCBEAM[0])',
+               **SIGNAL_EVENTS)
     def OscBeamMainSignal(self):
-        main_signal, _ = self.moco.osc_beam_signals()
+        main_signal, _ = self._read_snapshot(self.moco.osc_beam_signals)
         return main_signal
 
     @attribute(dtype=float,
                description='Query quadrature signal amplitude (equivalent to '
-                           '?OSCBEAM[1])')
+                           '?OSCBEAM[1])',
+               **SIGNAL_EVENTS)
     def OscBeamQuadSignal(self):
-        _, quad_signal = self.moco.osc_beam_signals()
+        _, quad_signal = self._read_snapshot(self.moco.osc_beam_signals)
         return quad_signal
 
-    @attribute(dtype=float,
-               description='Set/query oscillation phase (equivalent to '
-                           '?PHASE/PHASE)')
-    def Phase(self):
-        return self.moco.phase()
-
-    @Phase.write
-    def Phase(self, value):
-        self.moco.phase(value)
-
-    @attribute(dtype=float,
-               description='Set/query amplitude of oscillation (equivalent '
-                           'to ?AMPLITUDE/AMPLITUDE')
-    def Amplitude(self):
-        return self.moco.amplitude()
-
-    @Amplitude.write
-    def Amplitude(self, value):
-        self.moco.amplitude(value)
-
-    @attribute(dtype=float)
-    def Frequency(self):
-        return self.moco.frequency()
+    @attribute(dtype=str,
+               description='Link to the controller: CONNECTED or '
+                           'DISCONNECTED (reconnection pending)')
+    def ConnectionHealth(self):
+        return self.link.health
+
+    @attribute(dtype=int,
+               description='Number of reconnections since Init')
+    def Reconnections(self):
+        return self.link.reconnections
+
+    @attribute(dtype=float, unit='s',
+               description='Mean latency of the recent controller '
+                           'transactions (waiting for the device I/O '
+                           'worker included)')
+    def Latency(self):
+        _, mean, _ = self.moco.conn.latency()
+        return mean
+
+    @attribute(dtype=float, unit='s',
+               description='Maximum latency of the recent controller '
+                           'transactions')
+    def MaxLatency(self):
+        _, _, maximum = self.moco.conn.latency()
+        return maximum
+
+    @attribute(dtype=int,
+               description='Controller transactions waiting for the device '
+                           'I/O worker')
+    def PendingRequests(self):
+        return self.moco.conn.pending
+
+    def _io_total(self, name):
+        return self._read_snapshot(self.io_stats.total)[name]
+
+    @attribute(dtype=int,
+               description='Controller transactions since the I/O '
+                           'statistics reset (see ResetIOStatistics)')
+    def IOTransactions(self):
+        return self._io_total('count')
+
+    @attribute(dtype=int,
+               description='Failed controller transactions (timeouts '
+                           'excluded)')
+    def IOErrors(self):
+        return self._io_total('errors')
+
+    @attribute(dtype=int,
+               description='Controller transactions with a missing or '
+                           'incomplete answer')
+    def IOTimeouts(self):
+        return self._io_total('timeouts')
+
+    @attribute(dtype=int, unit='B',
+               description='Bytes written to the controller')
+    def IOBytesOut(self):
+        return self._io_total('bytes_out')
+
+    @attribute(dtype=int, unit='B',
+               description='Bytes read from the controller')
+    def IOBytesIn(self):
+        return self._io_total('bytes_in')
+
+    @attribute(dtype=float, unit='s',
+               description='Median latency of the controller transactions')
+    def IOLatencyP50(self):
+        return self._io_total('p50')
+
+    @attribute(dtype=float, unit='s',
+               description='95th percentile latency of the controller '
+                           'transactions')
+    def IOLatencyP95(self):
+        return self._io_total('p95')
+
+    @attribute(dtype=float, unit='s',
+               description='99th percentile latency of the controller '
+                           'transactions')
+    def IOLatencyP99(self):
+        return self._io_total('p99')
 
-    @Frequency.write
-    def Frequency(self, value):
-        self.moco.frequency(value)
+    @attribute(dtype=str,
+               description='JSON object of the I/O statistics by command: '
+                           '{"since": <reset time>, "total": {...}, '
+                           '"commands": {"?BEAM": {"count", "errors", '
+                           '"timeouts", "bytes_out", "bytes_in", "mean", '
+                           '"max", "p50", "p95", "p99"}, ...}}')
+    def IOStatistics(self):
+        return json.dumps({'since': self.io_stats.since,
+                           'total': self.io_stats.total(),
+                           'commands': self.io_stats.commands()})
 
-    @attribute(dtype=float,
-               description='Set/query response function slope (equivalent to '
-                           '?SLOPE/SLOPE)')
-    def Slope(self):
-        return self.moco.slope()
+    @attribute(dtype=str,
+               description='Last long-running operation started (TUNE, '
+                           'TUNE PEAK or GO)')
+    def Operation(self):
+        return self.operation.name
 
-    @Slope.write
-    def Slope(self, value):
-        self.moco.slope(value)
+    @attribute(dtype=bool,
+               description='True until the controller has finished the '
+                           'operation (no longer in MOVE, SCAN or SEARCH)')
+    def OperationRunning(self):
+        return self.operation.running
 
     @attribute(dtype=str,
-               description='Query response function oscil (equivalent to '
-                           '?OSCIL)')
-    def Oscil(self):
-        return self.moco.oscil()
\ No newline at end of file
+               description='Controller state during the operation, its '
+                           'final state once finished or the error')
+    def OperationProgress(self):
+        return self.operation.progress
+
+    @attribute(dtype=bool,
+               description='True while the signal acquisition is running')
+    def Acquiring(self):
+        return self.acquisition.running
+
+    @attribute(dtype=[float], max_dim_x=MAX_HISTORY_SIZE,
+               description='Acquisition sample timestamps (s since epoch)')
+    def HistoryTime(self):
+        return self._read_history('HistoryTime')
+
+    @attribute(dtype=[float], max_dim_x=MAX_HISTORY_SIZE,
+               description='Acquired INBEAM values (?BEAM[0])')
+    def HistoryBeamIn(self):
+        return self._read_history('HistoryBeamIn')
+
+    @attribute(dtype=[float], max_dim_x=MAX_HISTORY_SIZE,
+               description='Acquired OUTBEAM values (?BEAM[1])')
+    def HistoryBeamOut(self):
+        return self._read_history('HistoryBeamOut')
+
+    @attribute(dtype=[float], max_dim_x=MAX_HISTORY_SIZE,
+               description='Acquired filtered INBEAM values (?FBEAM[0])')
+    def HistoryFBeamIn(self):
+        return self._read_history('HistoryFBeamIn')
+
+    @attribute(dtype=[float], max_dim_x=MAX_HISTORY_SIZE,
+               description='Acquired filtered OUTBEAM values (?FBEAM[1])')
+    def HistoryFBeamOut(self):
+        return self._read_history('HistoryFBeamOut')
+
+    @attribute(dtype=[float], max_dim_x=MAX_HISTORY_SIZE,
+               description='Acquired output voltage values (?PIEZO)')
+    def HistoryPiezo(self):
+        return self._read_history('HistoryPiezo')
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the MoCo project
+#
+# Copyright (c) 2020 ALBA controls team
+# Distributed under the GNU General Public License v3.
+# See LICENSE for more info.
+
+import time
+import logging
+import threading
+
+
+class OperationMonitor:
+    """
+    Background tracking of a long-running controller operation (TUNE,
+    GO...): once started, ?STATE is read every period until the
+    controller leaves the BUSY states.
+
+    on_update is called with None when an operation starts, then with
+    each state read (or the exception if the read failed, which ends the
+    operation).
+    """
+
+    # ?STATE (without PAUSED prefix) while an operation runs
+    BUSY = ('MOVE', 'SCAN', 'SEARCH')
+
+    def __init__(self, moco, period, on_update):
+        self.log = logging.getLogger('{}.OperationMonitor'.format(__name__))
+        self.moco = moco
+        self.period = period
+        self.on_update = on_update
+        self.name = ''
+        self.running = False
+        self.progress = ''
+        self.start_time = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, name):
+        """Track the operation name (replacing the running one, if any)"""
+        with self._lock:
+            self.name = name
+            self.running = True
+            self.progress = 'STARTED'
+            self.start_time = time.time()
+            if self._thread is None:
+                # a stopped loop may still be finishing: it keeps its own
+                # event
+                self._stop = threading.Event()
+                self._thread = threading.Thread(
+                    target=self._run, args=(self._stop,),
+                    name='MocoOperation', daemon=True)
+                self._thread.start()
+        self.on_update(None)
+
+    def stop(self, timeout=None):
+        """
+        Stop tracking, waiting at most timeout seconds for the loop to end
+        (it never calls on_update once stopped)
+        """
+        with self._lock:
+            self._stop.set()
+            thread, self._thread = self._thread, None
+            self.running = False
+        if thread is not None:
+            thread.join(timeout)
+
+    def _run(self, stop):
+        while not stop.wait(self.period):
+            try:
+                state = self.moco.state()
+            except Exception as error:
+                if stop.is_set():
+                    break
+                self.log.warning('Error reading the %s state: %r',
+                                 self.name, error)
+                state = error
+            with self._lock:
+                if stop.is_set():
+                    break
+                if isinstance(state, Exception):
+                    self.progress = 'ERROR: {}'.format(state)
+                    self.running = False
+                else:
+                    words = state.split()
+                    self.progress = state
+                    self.running = bool(words) and words[-1] in self.BUSY
+            try:
+                self.on_update(state)
+            except Exception:
+                self.log.exception('Error handling the %s state', self.name)
+            # checked under the lock: start() may have restarted it
+            with self._lock:
+                if not self.running and not stop.is_set():
+                    self._thread = None
+                    return
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the MoCo project
+#
+# Copyright (c) 2020 ALBA controls team
+# Distributed under the GNU General Public License v3.
+# See LICENSE for more info.
+
+import time
+import logging
+import threading
+
+
+class Poller:
+    """
+    Background loop reading a set of values every period with a single
+    burst of requests.
+
+    values maps a name to a (query, decode) pair: decode converts the
+    answer of ?<query> into the value. on_values is called with a dict of
+    the decoded values (or with the exception if the burst failed).
+    """
+
+    def __init__(self, moco, values, period, on_values):
+        self.log = logging.getLogger('{}.Poller'.format(__name__))
+        self.moco = moco
+        self.values = values
+        self.queries = sorted({query for query, _ in values.values()})
+        self.period = period
+        self.on_values = on_values
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return (self._thread is not None and self._thread.is_alive() and
+                not self._stop.is_set())
+
+    def start(self):
+        if self.running or not self.queries:
+            return
+        # a stopped loop may still be finishing: it keeps its own event
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(self._stop,),
+                                        name='MocoPoller', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stop the loop, waiting at most timeout seconds for it to end (the
+        loop never calls on_values once stopped)
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def poll(self):
+        answers = dict(zip(self.queries, self.moco.read_cmds(self.queries)))
+        return {name: decode(answers[query])
+                for name, (query, decode) in self.values.items()}
+
+    def _run(self, stop):
+        while not stop.is_set():
+            start = time.time()
+            try:
+                values = self.poll()
+            except Exception as error:
+                if stop.is_set():
+                    break
+                self.log.warning('Error polling: %r', error)
+                values = error
+            if stop.is_set():
+                break
+            try:
+                self.on_values(values)
+            except Exception:
+                self.log.exception('Error handling polled values')
+            stop.wait(self.period - (time.time() - start))
@@ -19,7 +19,8 @@ requirements = [
 ]
 
 extra_requirements = {
-    "tango": ["pytango"],
+    "tango": ["pytango", "numpy"],
+    "asyncio": ["pyserial-asyncio"],
     "simulator": ["sinstruments>=1"],
     "sardana": ["sardana>=3.0.3", 'click']
 }
@@ -52,6 +53,9 @@ setup(
         'console_scripts': [
             'Moco=moco.tango.server.__main__:main [tango]',
         ],
+        'sinstruments.device': [
+            'Moco=moco.simulator.device:Moco [simulator]',
+        ],
     },
     extras_require=extra_requirements,
     install_requires=requirements,
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the MoCo project
+#
+# Copyright (c) 2020 ALBA controls team
+# Distributed under the GNU General Public License v3.
+# See LICENSE for more info.
+
+import time
+
+import pytest
+
+tango = pytest.importorskip('tango')
+from tango import DevState  # noqa: E402
+from tango.test_context import DeviceTestContext  # noqa: E402
+
+from moco.tango.server.moco import Moco  # noqa: E402
+
+
+def wait_for(func, timeout=10.0):
+    end = time.monotonic() + timeout
+    while not func():
+        assert time.monotonic() < end, 'timed out'
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def moco_no_poller():
+    context = DeviceTestContext(
+        Moco, properties={'url': 'mocosim://', 'eventPollingPeriod': 0,
+                          'operationPollingPeriod': 0.05},
+        process=True)
+    with context as device:
+        wait_for(lambda: device.State() != DevState.INIT)
+        yield device
+
+
+def test_no_poller_connected(moco_no_poller):
+    assert moco_no_poller.State() == DevState.ON
+
+
+def test_no_poller_keeps_operation_end_state(moco_no_poller):
+    moco_no_poller.Go()
+    wait_for(lambda: not moco_no_poller.OperationRunning, timeout=30)
+    assert moco_no_poller.MocoState == 'RUN'
+    # the state mapped at the end of Go is not reset to ON
+    for _ in range(3):
+        assert moco_no_poller.State() == DevState.RUNNING
+        assert 'RUN' in moco_no_poller.Status()